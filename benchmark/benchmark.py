@@ -0,0 +1,99 @@
+import sys
+sys.path.append("..")
+import json
+import argparse
+from qecsim.models.generic import BiasedDepolarizingErrorModel
+import toolbox
+
+# code distances, biases and bond dimensions of the simulations in this repository
+DISTANCES = list(range(5, 49, 2))
+BIASES = [0.5, 30, 100, 300, 1000]
+CHIS = [8]
+# error probability of each bias, near its threshold (see threshold_trend)
+ERROR_PROBABILITIES = {0.5: 0.19, 30: 0.34, 100: 0.40, 300: 0.45, 1000: 0.47}
+# numbers of worker processes, 0 for toolbox.run in the main process
+PROCESSES = [0, 1, 2, 4]
+N_SHOTS = 200
+# a smaller grid for a check before committing a change to the hot path
+QUICK = {'distances': [5, 13, 23], 'biases': [30, 300], 'chis': [8], 'processes': [0, 2], 'shots': 100}
+# relative change of a result against the baseline which is not flagged as a regression
+TOLERANCE = 0.2
+BASELINE = 'baseline.json'
+
+def benchmark_points(distances,biases,chis,family='xzzx'):
+    """
+    Points of the benchmark.
+    distances: list of code distances
+    biases: list of biases of the noise
+    chis: list of bond dimensions of the decoder
+    family: 'xzzx' for the XZZX code of qsdxzzx under Z-biased noise, or 'xy' for the
+        planar code of qecsim under Y-biased noise
+    return: list of (code, decoder, error_model, error_probability)
+    """
+    if family == 'xzzx':
+        from qsdxzzx.rotatedplanarxz import RotatedPlanarXZCode as Code, RotatedPlanarXZRMPSDecoder as Decoder
+        axis = 'Z'
+    else:
+        from qecsim.models.rotatedplanar import RotatedPlanarCode as Code, RotatedPlanarRMPSDecoder as Decoder
+        axis = 'Y'
+    points = []
+    for d in distances:
+        code = Code(d, d)
+        for chi in chis:
+            decoder = Decoder(chi=chi)
+            for bias in biases:
+                points.append((code, decoder, BiasedDepolarizingErrorModel(bias, axis), ERROR_PROBABILITIES[bias]))
+    return points
+
+def print_results(results):
+    """
+    Print one line per benchmark result.
+    results: list of dictionaries returned by toolbox.benchmark_point
+    return: none
+    """
+    for result in results:
+        stages = ' '.join('{}={:.2g}'.format(stage, per_shot) for stage, per_shot in result['stages'].items())
+        print('d={:<3} {:<45} processes={} {:8.2f} shots/s  {:6.0f} MB  s/shot: {}'.format(
+            result['d'], result['error_model'], result['processes'], result['shots_per_sec'], result['peak_rss'], stages))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the simulation hot path against a stored baseline.')
+    parser.add_argument('--quick', action='store_true', help='run the small grid of QUICK')
+    parser.add_argument('--distances', type=int, nargs='+', default=DISTANCES)
+    parser.add_argument('--biases', type=float, nargs='+', default=BIASES)
+    parser.add_argument('--chis', type=int, nargs='+', default=CHIS)
+    parser.add_argument('--processes', type=int, nargs='+', default=PROCESSES)
+    parser.add_argument('--shots', type=int, default=N_SHOTS)
+    parser.add_argument('--family', choices=['xzzx', 'xy'], default='xzzx')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args()
+    if args.quick:
+        for name, value in QUICK.items():
+            setattr(args, name, value)
+    biases = [int(bias) if float(bias).is_integer() else bias for bias in args.biases]
+    results = []
+    for point in benchmark_points(args.distances, biases, args.chis, args.family):
+        for processes in args.processes:
+            results.append(toolbox.benchmark_isolated(*point, args.shots, processes=processes))
+            print_results(results[-1:])
+    toolbox.scaling_efficiency(results)
+    for result in results:
+        if 'scaling_efficiency' in result:
+            print('{} scaling efficiency {:.2f}'.format(toolbox.benchmark_key(result), result['scaling_efficiency']))
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=1)
+    else:
+        try:
+            with open(args.baseline, 'r') as f:
+                baseline = json.load(f)
+        except FileNotFoundError:
+            print('no baseline in {}, store one with --save-baseline'.format(args.baseline))
+            sys.exit(0)
+        regressions = toolbox.compare_benchmarks(results, baseline, args.tolerance)
+        for line in regressions:
+            print('REGRESSION', line)
+        print('{} results, {} regressions'.format(len(results), len(regressions)))
+        sys.exit(1 if regressions else 0)
@@ -12,8 +12,7 @@ P0_1 = [0.4,0.41,0.46]
 P0_2 = [0.32,0.38,0.4]
 
 # ---------------------- plot p vs pf ------------------------
-data = toolbox.load_simdata('zbias{}_5.json'.format(ETA))
-run_case = data[0]['n_run']
+data = toolbox.SimDataset('.')
 
 # format plot
 fig = plt.figure(figsize=(7, 5))
@@ -23,17 +22,8 @@ plt.xlabel('d')
 bax.set_ylabel('$P_f$')
 # bax.set_ylim(0.25, 0.55)
 for p in P0_1:
-    d = []
-    p_f = []
-    for run in data:
-        if run['error_probability']>p-0.00001 and run['error_probability']<p+0.00001:
-            d.append(run['n_k_d'][2])
-            p_f.append(run['logical_failure_rate'])
-    # add error bar
-    p_f_error = []
-    for element in p_f:
-        p_f_error.append(np.sqrt(element*(1-element)/run_case))
-    bax.errorbar(d,p_f,p_f_error,fmt='o-',capsize=3,markersize=5,label='$p={}$'.format(p))
+    runs = data.query(bias=ETA,p=p)
+    bax.errorbar(runs['d'],runs['rate'],runs['rate_err'],fmt='o-',capsize=3,markersize=5,label='$p={}$'.format(p))
 bax.legend(loc='best',columnspacing=0.2,frameon=True)
 
 fig2 = plt.figure(figsize=(7, 5))
@@ -43,16 +33,7 @@ plt.xlabel('d')
 ax2.set_ylabel('$P_{f,Z}$')
 ax2.set_ylim(0.005, 0.125)
 for p in P0_2:
-    d = []
-    p_fz = []
-    for run in data:
-        if run['error_probability']>p-0.00001 and run['error_probability']<p+0.00001:
-            d.append(run['n_k_d'][2])
-            p_fz.append(run['logicalz_failure_rate'])
-    # add error bar
-    p_fz_error = []
-    for element in p_fz:
-        p_fz_error.append(np.sqrt(element*(1-element)/run_case))
-    ax2.errorbar(d,p_fz,p_fz_error,fmt='d-',capsize=3,markersize=5,label='$p={}$'.format(p))
+    runs = data.query(bias=ETA,p=p,channel='z')
+    ax2.errorbar(runs['d'],runs['rate'],runs['rate_err'],fmt='d-',capsize=3,markersize=5,label='$p={}$'.format(p))
 ax2.legend(loc='best',columnspacing=0.2,frameon=True)
 plt.show()
\ No newline at end of file
@@ -7,73 +7,81 @@ from scipy import optimize as op
 import toolbox
 
 ETA = 300
+# number of bootstrap replicas of each fit, 0 to use the standard deviations of the fit covariance
+N_BOOT = 1000
+# confidence level of the percentile intervals of the bootstrap
+LEVEL = 0.95
+# failure channels of the fits, in the column order of the output files
+CHANNELS = ['total', 'x', 'y', 'z']
+# points of each channel of each window file (see toolbox.migrate_channel_files)
+with open('windows.json5', 'r', encoding='utf-8') as f:
+    WINDOWS = json5.load(f)
 
-def get_threshold(eta,num):
-    data_total = toolbox.load_simdata('zbias{}_{}_total.json'.format(eta,num))
-    data_x = toolbox.load_simdata('zbias{}_{}_logicalx.json'.format(eta,num))
-    data_y = toolbox.load_simdata('zbias{}_{}_logicaly.json'.format(eta,num))
-    data_z = toolbox.load_simdata('zbias{}_{}_logicalz.json'.format(eta,num))
-    # put data from different code size together
-    p_ds, p_dxs, p_dys, p_dzs, pfs, pfxs, pfys, pfzs = [], [], [], [], [], [], [], []
-    for run in data_total:
-        p_ds.append([run['physical_error_rate'], run['n_k_d'][2]])
-        pfs.append(run['logical_failure_rate'])
-    for run in data_x:
-        p_dxs.append([run['physical_error_rate'], run['n_k_d'][2]])
-        pfxs.append(run['logicalx_failure_rate'])
-    for run in data_y:
-        p_dys.append([run['physical_error_rate'], run['n_k_d'][2]])
-        pfys.append(run['logicaly_failure_rate'])
-    for run in data_z:
-        p_dzs.append([run['physical_error_rate'], run['n_k_d'][2]])
-        pfzs.append(run['logicalz_failure_rate'])
-    # transform to array
-    p_ds = np.array(p_ds)
-    p_dxs = np.array(p_dxs)
-    p_dys = np.array(p_dys)
-    p_dzs = np.array(p_dzs)
-    pfs = np.array(pfs)
-    pfxs = np.array(pfxs)
-    pfys = np.array(pfys)
-    pfzs = np.array(pfzs)
+def load_window(eta,num):
+    """
+    Load the points of one distance window for each failure channel. All channels are columns
+    of the results in one window file, except the results of a conflicts file of a channel.
+    eta: bias of the noise
+    num: number of the window
+    return: a dictionary of channel to a dictionary with 'p', 'd', 'n_fail', 'n_run', 'rate' and
+        'rate_err' arrays
+    """
+    filename = 'zbias{}_{}.json'.format(eta,num)
+    table = toolbox.SimDataset('.', filenames=[filename]).table
+    window = {}
+    for channel in CHANNELS:
+        count, rate = toolbox.SimDataset.CHANNELS[channel]
+        rows = toolbox.channel_table(table, WINDOWS[filename][channel])
+        window[channel] = {
+            'p': rows['physical_error_rate'],
+            'd': rows['d'],
+            'n_fail': rows[count],
+            'n_run': rows['n_run'],
+            'rate': rows[rate],
+            'rate_err': np.sqrt(rows[rate + '_var']),
+        }
+    return window
 
-    # define fitting function
-    def fit_fun(p_d,pc,v,A,B,C):
-        """
-        global fitting function of p vs pf.
-        p_d: data form as (p,d), function input.
-        pc,v,A,B,C: function coefficient.
-        return: fitting value of function output.
-        """
-        x = (p_d[0]-pc)*p_d[1]**(1/v)
-        return (A + B*x + C*x**2)
-
-    # get fitting coefficients
-    popt, pcov = op.curve_fit(fit_fun,p_ds.T,pfs,maxfev=50000)
-    pc,nu = popt[0],popt[1]
-    # standard deviation of pc and nu
-    pc_err, nu_err = pcov[0,0]**0.5, pcov[1,1]**0.5
-    poptx, pcovx = op.curve_fit(fit_fun,p_dxs.T,pfxs,maxfev=50000)
-    pcx,nux = poptx[0],poptx[1]
-    # standard deviation of pc and nu
-    pcx_err, nux_err = pcovx[0,0]**0.5, pcovx[1,1]**0.5
-    popty, pcovy = op.curve_fit(fit_fun,p_dys.T,pfys,maxfev=50000)
-    pcy,nuy = popty[0],popty[1]
-    # standard deviation of pc and nu
-    pcy_err, nuy_err = pcovy[0,0]**0.5, pcovy[1,1]**0.5
-    poptz, pcovz = op.curve_fit(fit_fun,p_dzs.T,pfzs,maxfev=50000)
-    pcz,nuz = poptz[0],poptz[1]
-    # standard deviation of pc and nu
-    pcz_err, nuz_err = pcovz[0,0]**0.5, pcovz[1,1]**0.5
-    with open('zbias{}_pc.txt'.format(ETA),"a", encoding='utf-8') as f:
-        f.writelines(['{},{},{},{},{},{},{},{},{}'.format(10*num-3,pc,pcx,pcy,pcz,pc_err,pcx_err,pcy_err,pcz_err)])
-        f.write('\n')
-    f.close()
-    with open('zbias{}_nu.txt'.format(ETA),"a", encoding='utf-8') as f:
-        f.writelines(['{},{},{},{},{},{},{},{},{}'.format(10*num-3,nu,nux,nuy,nuz,nu_err,nux_err,nuy_err,nuz_err)])
-        f.write('\n')
-    f.close()
+def get_thresholds(eta,nums):
+    """
+    Fit the thresholds of all windows and write them into the files, one line per window:
+    code distance, pc (or nu) of the total, X, Y and Z channels, their standard deviations and,
+    with bootstrap, the lower and upper bounds of their percentile intervals. The bootstrap replicas
+    are kept in zbias{eta}_bootstrap.npz for the next run.
+    eta: bias of the noise
+    nums: numbers of the windows, in order of code distance
+    return: none
+    """
+    fits = toolbox.fit_threshold_trend([load_window(eta,num) for num in nums], n_boot=N_BOOT, seed=0,
+                                       cache='zbias{}_bootstrap.npz'.format(eta), level=LEVEL)
+    for i, num in enumerate(nums):
+        pcs, nus, pc_errs, nu_errs = [], [], [], []
+        pc_lows, pc_highs, nu_lows, nu_highs = [], [], [], []
+        for channel in CHANNELS:
+            fit = fits[channel][i]
+            pcs.append(fit['popt'][0])
+            nus.append(fit['popt'][1])
+            # standard deviation of pc and nu
+            if N_BOOT:
+                pc_err, nu_err = np.nanstd(fit['bootstrap'][:, :2], axis=0, ddof=1)
+            else:
+                pc_err, nu_err = fit['pcov'][0,0]**0.5, fit['pcov'][1,1]**0.5
+            pc_errs.append(pc_err)
+            nu_errs.append(nu_err)
+            # percentile intervals of pc and nu
+            if N_BOOT:
+                low, high = fit['interval']
+                pc_lows.append(low[0])
+                pc_highs.append(high[0])
+                nu_lows.append(low[1])
+                nu_highs.append(high[1])
+        with open('zbias{}_pc.txt'.format(eta),"a", encoding='utf-8') as f:
+            f.writelines([','.join(str(value) for value in [10*num-3] + pcs + pc_errs + pc_lows + pc_highs)])
+            f.write('\n')
+        with open('zbias{}_nu.txt'.format(eta),"a", encoding='utf-8') as f:
+            f.writelines([','.join(str(value) for value in [10*num-3] + nus + nu_errs + nu_lows + nu_highs)])
+            f.write('\n')
 
 # get thresholds and write them into the file
-for num in range(2,11):
-    get_threshold(ETA,num)
+if __name__ == '__main__':
+    get_thresholds(ETA, range(2,11))
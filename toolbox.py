@@ -2,189 +2,579 @@ import json5
 import time
 import logging
 import json
-import statistics
+import os
+import sys
+import math
+import re
+import glob
+import collections
 import multiprocessing
+from multiprocessing import shared_memory
+import queue
+import pickle
+import socket
+import threading
+import warnings
 import numpy as np
+from scipy import optimize as op
 from qecsim import paulitools as pt
 
 logger = logging.getLogger(__name__)
 
-def run(code,decoder,error_model,error_probability,max_runs):
+# X and Z parts of the binary symplectic form of I, X, Y and Z (indices 0, 1, 2 and 3)
+_PAULI_X_BITS = np.array([0, 1, 1, 0], dtype=np.uint8)
+_PAULI_Z_BITS = np.array([0, 0, 1, 1], dtype=np.uint8)
+
+def sample_errors(n_qubits,probability_distribution,n_shots,rng,packed=False):
     """
-    This is a packaged code sequence for running simulation max_runs times 
-    with recording the failure rate for each logical operator, and returns to a 
-    dictionary of running data.
+    Sample a batch of random errors in binary symplectic form with one NumPy call.
+    n_qubits: number of physical qubits of the code
+    probability_distribution: (p_I, p_X, p_Y, p_Z) of one qubit, i.e. the output of
+        error_model.probability_distribution(error_probability), computed once per error probability
+    n_shots: number of errors to sample
+    rng: numpy random generator
+    packed: if True, return the errors in packed form (see pack_bsf), 8 times smaller
+    return: a (n_shots, 2*n_qubits) uint8 array of errors (or its packed form)
+    """
+    paulis = rng.choice(4, size=(n_shots, n_qubits), p=probability_distribution)
+    errors = np.hstack((_PAULI_X_BITS[paulis], _PAULI_Z_BITS[paulis]))
+    if packed:
+        return pack_bsf(errors)
+    return errors
+
+def pack_bsf(bsf):
+    """
+    Pack operators in binary symplectic form into 64-bit words: the X part of each operator takes
+    the first ceil(n/64) words, the Z part the next ones, with qubit i at bit i%64 of word i//64
+    of its part and the unused bits of the last word of each part 0.
+    bsf: (..., 2n) array of operators in binary symplectic form
+    return: (..., 2*ceil(n/64)) uint64 array of packed operators
+    """
+    bsf = np.asarray(bsf)
+    n = bsf.shape[-1] // 2
+    n_words = -(-n // 64)
+    parts = np.zeros(bsf.shape[:-1] + (2, n_words * 64), dtype=np.uint8)
+    parts[..., 0, :n] = bsf[..., :n]
+    parts[..., 1, :n] = bsf[..., n:]
+    packed = np.packbits(parts, axis=-1, bitorder='little')
+    return packed.view('<u8').reshape(bsf.shape[:-1] + (2 * n_words,)).astype(np.uint64, copy=False)
+
+def unpack_bsf(packed,n_qubits):
+    """
+    Unpack operators packed by pack_bsf.
+    packed: (..., 2*ceil(n/64)) uint64 array of packed operators
+    n_qubits: number of physical qubits n
+    return: (..., 2n) uint8 array of operators in binary symplectic form
+    """
+    packed = np.ascontiguousarray(packed, dtype='<u8')
+    n_words = packed.shape[-1] // 2
+    bits = np.unpackbits(packed.view(np.uint8).reshape(packed.shape[:-1] + (2, n_words * 8)),
+                         axis=-1, count=n_qubits, bitorder='little')
+    return bits.reshape(packed.shape[:-1] + (2 * n_qubits,))
+
+def _as_packed(operators):
+    """
+    Packed form of operators given in binary symplectic form or already packed (uint64).
+    """
+    operators = np.asarray(operators)
+    return operators if operators.dtype == np.uint64 else pack_bsf(operators)
+
+# number of set bits of each byte, for NumPy without np.bitwise_count
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def _popcount(words):
+    """
+    Number of set bits of each element of a uint64 array.
+    """
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+    words = np.ascontiguousarray(words)
+    return _POPCOUNT_TABLE[words.view(np.uint8)].reshape(words.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+def bsf_weights(packed):
+    """
+    Weights of packed operators, i.e. pt.bsf_wt of each of them.
+    packed: (..., 2*ceil(n/64)) uint64 array of packed operators (see pack_bsf)
+    return: (...) int64 array of weights
+    """
+    n_words = packed.shape[-1] // 2
+    return _popcount(packed[..., :n_words] | packed[..., n_words:]).sum(axis=-1, dtype=np.int64)
+
+# bound on the number of words of the one intermediate array of bsp_packed (64 MB)
+_BSP_CHUNK_WORDS = 1 << 23
+
+def bsp_packed(a,b):
+    """
+    Binary symplectic products of a block of packed vectors with a block of packed vectors. Each
+    product is the parity of the set bits of (a_X & b_Z) ^ (a_Z & b_X), which is the parity of the
+    XOR of the words of a_X & b_Z and of a_Z & b_X, so one popcount per pair is enough. Both ANDs
+    are computed in turn into one buffer of at most _BSP_CHUNK_WORDS words.
+    a: (N, 2W) uint64 array of packed vectors (see pack_bsf), e.g. a block of errors
+    b: (m, 2W) uint64 array of packed vectors, e.g. a stack of stabilizers and logicals
+    return: (N, m) uint8 array of binary symplectic products, i.e. pt.bsp(a[i], b[j]) at [i, j]
+    """
+    n_words = a.shape[-1] // 2
+    b_x, b_z = b[:, :n_words], b[:, n_words:]
+    products = np.empty((len(a), len(b)), dtype=np.uint8)
+    rows = max(1, _BSP_CHUNK_WORDS // max(1, len(b) * n_words))
+    buffer = np.empty((min(rows, len(a)), len(b), n_words), dtype=np.uint64)
+    for start in range(0, len(a), rows):
+        a_x = a[start:start+rows, None, :n_words]
+        a_z = a[start:start+rows, None, n_words:]
+        words = buffer[:len(a_x)]
+        np.bitwise_and(a_x, b_z, out=words)
+        parities = np.bitwise_xor.reduce(words, axis=2)
+        np.bitwise_and(a_z, b_x, out=words)
+        parities ^= np.bitwise_xor.reduce(words, axis=2)
+        products[start:start+rows] = _popcount(parities) & 1
+    return products
+
+def sample_weight_errors(n_qubits,probability_distribution,weight,n_shots,rng):
+    """
+    Sample a batch of random errors of fixed weight in binary symplectic form, i.e. errors of the
+    distribution of sample_errors conditioned on their weight: the support is uniformly random
+    and each Pauli of it is X, Y or Z with probability p_X, p_Y and p_Z over p_X+p_Y+p_Z.
+    n_qubits: number of physical qubits of the code
+    probability_distribution: (p_I, p_X, p_Y, p_Z) of one qubit
+    weight: weight of the errors
+    n_shots: number of errors to sample
+    rng: numpy random generator
+    return: a (n_shots, 2*n_qubits) uint8 array of errors
+    """
+    probability_distribution = np.asarray(probability_distribution, dtype=float)
+    paulis = np.zeros((n_shots, n_qubits), dtype=np.int64)
+    if weight:
+        support = np.argpartition(rng.random((n_shots, n_qubits)), weight - 1, axis=1)[:, :weight]
+        paulis[np.arange(n_shots)[:, None], support] = rng.choice(
+            [1, 2, 3], size=(n_shots, weight), p=probability_distribution[1:] / probability_distribution[1:].sum())
+    return np.hstack((_PAULI_X_BITS[paulis], _PAULI_Z_BITS[paulis]))
+
+def sample_composition_errors(n_qubits,composition,n_shots,rng):
+    """
+    Sample a batch of random errors of fixed composition in binary symplectic form: the support
+    is uniformly random, and exactly a_X, a_Y and a_Z of its qubits have an X, Y and Z error, in
+    a uniformly random arrangement.
+    n_qubits: number of physical qubits of the code
+    composition: (w, a_X, a_Y, a_Z) with w = a_X + a_Y + a_Z
+    n_shots: number of errors to sample
+    rng: numpy random generator
+    return: a (n_shots, 2*n_qubits) uint8 array of errors
+    """
+    weight, a_x, a_y, a_z = composition
+    paulis = np.zeros((n_shots, n_qubits), dtype=np.int64)
+    if weight:
+        keys = rng.random((n_shots, n_qubits))
+        support = np.argpartition(keys, weight - 1, axis=1)[:, :weight]
+        # order the support by its keys, so the fixed pattern below lands on it uniformly at random
+        support = np.take_along_axis(support, np.argsort(np.take_along_axis(keys, support, axis=1), axis=1), axis=1)
+        paulis[np.arange(n_shots)[:, None], support] = np.repeat([1, 2, 3], [a_x, a_y, a_z])
+    return np.hstack((_PAULI_X_BITS[paulis], _PAULI_Z_BITS[paulis]))
+
+# arrays of a CodeContext which are built from the code, and shared with workers by share_code_contexts
+CONTEXT_ARRAYS = ['stabilizers_packed', 'checks_packed']
+
+class CodeContext:
+    """
+    Per-code arrays used by the run functions, built once per code instead of once per shot.
     code: XZZX code
-    decoder: XZZX MPS decoder
-    error_model: error model used in simulation
-    error_probability: error probability parameter used in simulation
-    max_runs: number of simulation running times
-    return: a dictionary with running data
+    arrays: if given, a dictionary of the CONTEXT_ARRAYS, e.g. views of shared memory (see
+        attach_code_contexts), used instead of building them from the code
     """
-    wall_time_start = time.perf_counter()
-    # initialize runs_data
-    runs_data = {
-        'code': code.label,
-        'n_k_d': code.n_k_d,
-        'time_steps': 1, # 1 for ideal simulation
-        'decoder': decoder.label,
-        'error_model' : error_model.label,
-        'error_probability': error_probability,
-        'measurement_error_probability': 0.0, # 0 for ideal simulation
-        'n_run': 0,
-        'n_success': 0,
-        'n_fail': 0,
-        'n_xfail': 0,
-        'n_yfail': 0,
-        'n_zfail': 0,
-        'n_logical_commutations': None,
-        'custom_totals': None,
-        'error_weight_total': 0,
-        'error_weight_pvar': 0.0,
-        'logical_failure_rate': 0.0,
-        'physical_error_rate': 0.0,
-        'wall_time': 0.0,
-    }
-    error_weights = []  # list of error_weight from current run
-
-    # initialize rng
-    rng = np.random.default_rng()
-
-    # each error probability is simulated max_run times
-    for run in range(max_runs):
-        # generate a random error
-        n_qubits = code.n_k_d[0]
-        error_pauli = ''.join(rng.choice(
-            ('I', 'X', 'Y', 'Z'),
-            size=n_qubits,
-            p=error_model.probability_distribution(error_probability)
-        ))
-        error = pt.pauli_to_bsf(error_pauli)
-        # transform error to syndrome
-        syndrome = pt.bsp(error, code.stabilizers.T)
-        # decode to find recovery
-        recovery = decoder.decode(code, syndrome, error_model, error_probability)
-        # check if recovery is success or not
-        # check if recovery communicate with stabilizers
-        commutes_with_stabilizers = np.all(pt.bsp(recovery^error, code.stabilizers.T) == 0)
-        if not commutes_with_stabilizers:
-            log_data = {  # enough data to recreate issue
-                # models
-                'code': repr(code), 'decoder': repr(decoder),
-                # variables
-                'error': pt.pack(error), 'recovery': pt.pack(recovery),
-            }
-            logger.warning('RECOVERY DOES NOT RETURN TO CODESPACE: {}'.format(json.dumps(log_data, sort_keys=True)))
-        # check if recovery communicate with logical operations
-        commutes_with_logicals = np.all(pt.bsp(recovery^error, code.logicals.T) == 0)
-        # respectively check if recovery communicate with logical X, Y and Z
-        # define logical y 
-        logical_ys = code.logical_xs^code.logical_zs
-        commutes_with_logicalx = np.all(pt.bsp(recovery^error, code.logical_xs.T) == 0)
-        commutes_with_logicaly = np.all(pt.bsp(recovery^error, logical_ys.T) == 0)
-        commutes_with_logicalz = np.all(pt.bsp(recovery^error, code.logical_zs.T) == 0)
-        # success if recovery communicate with both stabilizers and logical operations
-        success = commutes_with_stabilizers and commutes_with_logicals
-        # record the logical x, y and z failures seperately
-        failure_x = commutes_with_stabilizers and not commutes_with_logicalx
-        failure_y = commutes_with_stabilizers and not commutes_with_logicaly
-        failure_z = commutes_with_stabilizers and not commutes_with_logicalz
-        # increment run counts
-        runs_data['n_run'] += 1
-        if success:
-            runs_data['n_success'] += 1
+    def __init__(self,code,arrays=None):
+        self.key = (code.label, tuple(code.n_k_d))
+        self.n_qubits = code.n_k_d[0]
+        if arrays is not None:
+            for name in CONTEXT_ARRAYS:
+                setattr(self, name, arrays[name])
         else:
-            runs_data['n_fail'] += 1
-        if failure_x:
-            runs_data['n_xfail'] += 1
-        if failure_y:
-            runs_data['n_yfail'] += 1
-        if failure_z:
-            runs_data['n_zfail'] += 1
-        # append error weight
-        error_weights.append(pt.bsf_wt(np.array(error)))
-
-    # error weight statistics
-    runs_data['error_weight_total'] = sum(error_weights)
-    runs_data['error_weight_pvar'] = statistics.pvariance(error_weights)
+            stabilizers = np.asarray(code.stabilizers)
+            logical_xs = np.asarray(code.logical_xs)
+            logical_zs = np.asarray(code.logical_zs)
+            # define logical y
+            logical_ys = logical_xs^logical_zs
+            # packed forms for bsp over blocks, and the packed stacked check matrix of stabilizers
+            # and logical X, Y and Z
+            self.stabilizers_packed = pack_bsf(stabilizers)
+            self.checks_packed = pack_bsf(np.vstack((stabilizers, logical_xs, logical_ys, logical_zs)))
+        # rows of each kind of the check matrix, with as many logical X, Y and Z as logical qubits
+        n_stabilizers = len(self.stabilizers_packed)
+        n_x = n_y = n_z = (len(self.checks_packed) - n_stabilizers) // 3
+        self.stabilizer_rows = slice(0, n_stabilizers)
+        self.logicalx_rows = slice(n_stabilizers, n_stabilizers + n_x)
+        self.logicaly_rows = slice(n_stabilizers + n_x, n_stabilizers + n_x + n_y)
+        self.logicalz_rows = slice(n_stabilizers + n_x + n_y, n_stabilizers + n_x + n_y + n_z)
 
-    # record wall_time
-    runs_data['wall_time'] = time.perf_counter() - wall_time_start
+    def syndromes(self,errors):
+        """
+        Syndromes of a block of errors.
+        errors: (N, 2n) array of errors in binary symplectic form, or its packed form (see pack_bsf)
+        return: (N, number of stabilizers) uint8 array of syndromes
+        """
+        return bsp_packed(_as_packed(errors), self.stabilizers_packed)
 
-    # add rate statistics
-    time_steps = runs_data['time_steps']
-    n_run = runs_data['n_run']
-    n_fail = runs_data['n_fail']
-    n_xfail = runs_data['n_xfail']
-    n_yfail = runs_data['n_yfail']
-    n_zfail = runs_data['n_zfail']
-    error_weight_total = runs_data['error_weight_total']
-    code_n_qubits = runs_data['n_k_d'][0]
+    def anticommutations(self,operators):
+        """
+        Anticommutation of a block of operators with the stacked check matrix.
+        operators: (N, 2n) array of operators in binary symplectic form, or its packed form
+        return: (N, number of checks) boolean array
+        """
+        return bsp_packed(_as_packed(operators), self.checks_packed).astype(bool)
 
-    runs_data['logical_failure_rate'] = n_fail / n_run
-    runs_data['logicalx_failure_rate'] = n_xfail / n_run
-    runs_data['logicaly_failure_rate'] = n_yfail / n_run
-    runs_data['logicalz_failure_rate'] = n_zfail / n_run
-    runs_data['physical_error_rate'] = error_weight_total / code_n_qubits / time_steps / n_run
-    
-    return runs_data
+# cache of CodeContext, keyed by code label and n_k_d
+_code_contexts = {}
+
+def code_context(code):
+    """
+    Get the cached CodeContext of a code, building it on first use. The context is shared by
+    all error probabilities and run functions using the same code.
+    code: XZZX code
+    return: CodeContext of the code
+    """
+    key = (code.label, tuple(code.n_k_d))
+    context = _code_contexts.get(key)
+    if context is None:
+        context = _code_contexts[key] = CodeContext(code)
+    return context
+
+def share_code_contexts(codes):
+    """
+    Copy the arrays of the CodeContext of each distinct code into one shared memory block per code,
+    so that the workers of a pool map them with attach_code_contexts instead of building or
+    receiving their own copies. The memory of the workers then stays flat as their number grows.
+    codes: list of codes, possibly with repeats
+    return: a list of descriptors of the shared contexts, to be sent to the workers, and a list of
+        the SharedMemory blocks, to be closed and unlinked by the caller (see release_shared_memory)
+    """
+    descriptors = []
+    blocks = []
+    keys = set()
+    for code in codes:
+        context = code_context(code)
+        if context.key in keys:
+            continue
+        keys.add(context.key)
+        arrays = {name: np.ascontiguousarray(getattr(context, name)) for name in CONTEXT_ARRAYS}
+        # arrays are laid out one after another, each aligned to 64 bytes
+        layout = {}
+        offset = 0
+        for name, array in arrays.items():
+            layout[name] = (offset, array.shape, array.dtype.str)
+            offset += -(-array.nbytes // 64) * 64
+        block = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        blocks.append(block)
+        for name, array in arrays.items():
+            start, shape, dtype = layout[name]
+            np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=start)[...] = array
+        descriptors.append({'key': context.key, 'name': block.name, 'layout': layout})
+    return descriptors, blocks
 
-def run_once(index,code,decoder,error_model,error_probability,error_paulis):
+def attach_code_contexts(codes,descriptors):
     """
-    This is a sub-function for 'run_multicore' function.
+    Map the contexts shared by share_code_contexts, and use them as the cached CodeContext of
+    their codes in this process. The arrays are read-only views of the shared memory.
+    codes: list of codes, including those of the descriptors
+    descriptors: list of descriptors returned by share_code_contexts
+    return: list of the attached SharedMemory blocks, to be kept open while the contexts are used
     """
-    # index parameter is used for Pool
-    id = index
-    error_pauli = error_paulis[id]
-    error = pt.pauli_to_bsf(error_pauli)
-    # transform error to syndrome
-    syndrome = pt.bsp(error, code.stabilizers.T)
-    # decode to find recovery
-    recovery = decoder.decode(code, syndrome, error_model,error_probability)
-    # check if recovery is success or not
+    codes = {(code.label, tuple(code.n_k_d)): code for code in codes}
+    blocks = []
+    for descriptor in descriptors:
+        key = (descriptor['key'][0], tuple(descriptor['key'][1]))
+        block = shared_memory.SharedMemory(name=descriptor['name'])
+        blocks.append(block)
+        arrays = {}
+        for name, (start, shape, dtype) in descriptor['layout'].items():
+            arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=start)
+            arrays[name].flags.writeable = False
+        _code_contexts[key] = CodeContext(codes[key], arrays)
+    return blocks
+
+def release_shared_memory(blocks):
+    """
+    Close and unlink SharedMemory blocks created by share_code_contexts. Contexts attached to them
+    must not be used afterwards.
+    blocks: list of SharedMemory blocks
+    """
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+def verify_block(code,decoder,errors,recoveries):
+    """
+    Check a block of recoveries against the errors they were decoded from. Commutation with
+    stabilizers and logical X, Y and Z of all shots is computed with one stacked check matrix.
+    code: XZZX code
+    decoder: XZZX MPS decoder (only used for logging)
+    errors: (N, 2n) array of errors in binary symplectic form, or its packed form (see pack_bsf)
+    recoveries: (N, 2n) array of recoveries in binary symplectic form, or its packed form
+    return: a dictionary of boolean arrays of length N with keys 'commutes_with_stabilizers',
+        'success', 'failure_x', 'failure_y' and 'failure_z'
+    """
+    context = code_context(code)
+    errors = _as_packed(errors)
+    recoveries = _as_packed(recoveries)
+    residuals = recoveries ^ errors
+    anticommutes = context.anticommutations(residuals)
     # check if recovery communicate with stabilizers
-    commutes_with_stabilizers = np.all(pt.bsp(recovery^error, code.stabilizers.T) == 0)
-    if not commutes_with_stabilizers:
+    commutes_with_stabilizers = ~anticommutes[:, context.stabilizer_rows].any(axis=1)
+    for i in np.flatnonzero(~commutes_with_stabilizers):
         log_data = {  # enough data to recreate issue
             # models
             'code': repr(code), 'decoder': repr(decoder),
             # variables
-            'error': pt.pack(error), 'recovery': pt.pack(recovery),
+            'error': pt.pack(unpack_bsf(errors[i], context.n_qubits)),
+            'recovery': pt.pack(unpack_bsf(recoveries[i], context.n_qubits)),
         }
         logger.warning('RECOVERY DOES NOT RETURN TO CODESPACE: {}'.format(json.dumps(log_data, sort_keys=True)))
-    # check if recovery communicates with logical operations
-    commutes_with_logicals = np.all(pt.bsp(recovery^error, code.logicals.T) == 0)
-    # respectively check if recovery communicates with logical X, Y and Z
-    # define logical y 
-    logical_ys = code.logical_xs^code.logical_zs
-    commutes_with_logicalx = np.all(pt.bsp(recovery^error, code.logical_xs.T) == 0)
-    commutes_with_logicaly = np.all(pt.bsp(recovery^error, logical_ys.T) == 0)
-    commutes_with_logicalz = np.all(pt.bsp(recovery^error, code.logical_zs.T) == 0)
-    # success if recovery communicate with both stabilizers and logical operations
-    success = commutes_with_stabilizers and commutes_with_logicals
-    # record the logical x, y and z failures seperately
-    failure_x = commutes_with_stabilizers and not commutes_with_logicalx
-    failure_y = commutes_with_stabilizers and not commutes_with_logicaly
-    failure_z = commutes_with_stabilizers and not commutes_with_logicalz
-    error_weight = pt.bsf_wt(np.array(error))
-    # return to a list containing success, error_weight and different failure types
-    return [success,error_weight,failure_x,failure_y,failure_z]
-
-def run_multicore(code,decoder,error_model,error_probability,max_runs):
+    # respectively check if recovery communicate with logical X, Y and Z
+    commutes_with_logicalx = ~anticommutes[:, context.logicalx_rows].any(axis=1)
+    commutes_with_logicaly = ~anticommutes[:, context.logicaly_rows].any(axis=1)
+    commutes_with_logicalz = ~anticommutes[:, context.logicalz_rows].any(axis=1)
+    return {
+        'commutes_with_stabilizers': commutes_with_stabilizers,
+        # success if recovery communicate with both stabilizers and logical operations
+        'success': commutes_with_stabilizers & commutes_with_logicalx & commutes_with_logicalz,
+        # record the logical x, y and z failures seperately
+        'failure_x': commutes_with_stabilizers & ~commutes_with_logicalx,
+        'failure_y': commutes_with_stabilizers & ~commutes_with_logicaly,
+        'failure_z': commutes_with_stabilizers & ~commutes_with_logicalz,
+    }
+
+class DecodeCache:
     """
-    This is a packaged code sequence for running simulation max_runs times 
-    with recording the failure rate for each logical operator in multi-cores parallely, 
-    and returns to a dictionary of running data.
+    Bounded least-recently-used cache of recoveries of one simulation point, keyed by the
+    bit-packed syndrome. At low error probability or high bias a few syndromes make up most
+    shots, and their recoveries are looked up instead of decoded again. The recovery of the
+    empty syndrome is kept apart and never evicted. The decoder must be deterministic, as
+    the RMPS decoders are, for cached results to equal decoded ones.
+    maxsize: maximal number of cached syndromes
+    key: identity of the point, e.g. from point_key, kept to check the cache is used for one point only
+    """
+    def __init__(self,maxsize,key=None):
+        self.maxsize = maxsize
+        self.key = key
+        self.recoveries = collections.OrderedDict()
+        self.zero_recovery = None
+        self.hits = 0
+        self.misses = 0
+        self.zero_syndrome_hits = 0
+
+    def decode(self,code,decoder,error_model,error_probability,syndrome):
+        """
+        Decode a syndrome, or look its recovery up.
+        return: recovery
+        """
+        if not syndrome.any():
+            # fast path for the empty syndrome
+            if self.zero_recovery is None:
+                self.misses += 1
+                self.zero_recovery = decoder.decode(code, syndrome, error_model, error_probability)
+            else:
+                self.hits += 1
+                self.zero_syndrome_hits += 1
+            return self.zero_recovery
+        key = np.packbits(syndrome.astype(np.uint8)).tobytes()
+        recovery = self.recoveries.get(key)
+        if recovery is not None:
+            self.hits += 1
+            self.recoveries.move_to_end(key)
+            return recovery
+        self.misses += 1
+        recovery = decoder.decode(code, syndrome, error_model, error_probability)
+        self.recoveries[key] = recovery
+        if len(self.recoveries) > self.maxsize:
+            self.recoveries.popitem(last=False)
+        return recovery
+
+    def stats(self):
+        """
+        Hit and miss counts of the cache.
+        return: a dictionary with hits, misses and zero_syndrome_hits
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'zero_syndrome_hits': self.zero_syndrome_hits}
+
+def decode_block(code,decoder,error_model,error_probability,errors,cache=None,timings=None):
+    """
+    Decode a block of errors.
     code: XZZX code
     decoder: XZZX MPS decoder
     error_model: error model used in simulation
     error_probability: error probability parameter used in simulation
-    max_runs: number of simulation running times
-    return: a dictionary with running data
+    errors: (N, 2n) array of errors in binary symplectic form, or its packed form (see pack_bsf)
+    cache: optional DecodeCache of this point
+    timings: if given, a dictionary to which the seconds spent on the syndromes of the block and
+        on decoding each shot are added as 'syndrome' and 'decode' lists
+    return: (N, 2n) array of recoveries
     """
-    wall_time_start = time.perf_counter()
-    # initialize runs_data
-    runs_data = {
+    shape = (len(errors), 2 * code.n_k_d[0])
+    if timings is not None:
+        start = time.perf_counter()
+        syndromes = code_context(code).syndromes(errors)
+        timings.setdefault('syndrome', []).append(time.perf_counter() - start)
+        decode = cache.decode if cache is not None else (
+            lambda code, decoder, error_model, error_probability, syndrome:
+            decoder.decode(code, syndrome, error_model, error_probability))
+        recoveries = []
+        decode_times = timings.setdefault('decode', [])
+        for syndrome in syndromes:
+            start = time.perf_counter()
+            recoveries.append(decode(code, decoder, error_model, error_probability, syndrome))
+            decode_times.append(time.perf_counter() - start)
+        return np.array(recoveries).reshape(shape)
+    # transform errors to syndromes
+    syndromes = code_context(code).syndromes(errors)
+    # decode to find recoveries
+    if cache is not None:
+        return np.array([cache.decode(code, decoder, error_model, error_probability, syndrome)
+                         for syndrome in syndromes]).reshape(shape)
+    return np.array([decoder.decode(code, syndrome, error_model, error_probability)
+                     for syndrome in syndromes]).reshape(shape)
+
+def count_block(code,decoder,error_model,error_probability,errors,cache=None,profile=False):
+    """
+    Decode and check a block of errors.
+    code: XZZX code
+    decoder: XZZX MPS decoder
+    error_model: error model used in simulation
+    error_probability: error probability parameter used in simulation
+    errors: (N, 2n) array of errors in binary symplectic form, or its packed form (see pack_bsf)
+    cache: optional DecodeCache of this point; its hits and misses in this block are counted
+    profile: if True, the seconds spent on each stage are returned as counts['profile'] (see add_profile)
+    return: a dictionary of counters of this block.
+    """
+    # errors are packed once for their weights, syndromes and verification
+    errors = _as_packed(errors)
+    error_weights = bsf_weights(errors)
+    cache_stats = cache.stats() if cache is not None else None
+    timings = {} if profile else None
+    recoveries = decode_block(code, decoder, error_model, error_probability, errors, cache, timings)
+    # check if recoveries are success or not
+    start = time.perf_counter()
+    checked = verify_block(code, decoder, errors, recoveries)
+    if profile:
+        timings['verify'] = [time.perf_counter() - start]
+    counts = {
+        'n_run': len(errors),
+        'n_success': int(checked['success'].sum()),
+        'n_xfail': int(checked['failure_x'].sum()),
+        'n_yfail': int(checked['failure_y'].sum()),
+        'n_zfail': int(checked['failure_z'].sum()),
+        'error_weight_total': int(error_weights.sum()),
+        'error_weight_sqtotal': int((error_weights.astype(np.int64)**2).sum()), # for error_weight_pvar
+    }
+    if cache is not None:
+        counts['decode_cache'] = {name: value - cache_stats[name] for name, value in cache.stats().items()}
+    if profile:
+        counts['profile'] = timings
+    return counts
+
+def profile_block(counts,sample_time,start):
+    """
+    Complete the stage timings of a block counted by count_block(..., profile=True) with the time
+    spent on sampling its errors, and the process, busy time and end of the block, from which the
+    utilization of each worker and the time spent passing results between processes follow.
+    counts: a dictionary of counters of a block, with 'profile'
+    sample_time: seconds spent on sampling the errors (including their binary symplectic form),
+        or a list of them, one per block of a chunk (see count_chunk)
+    start: time.perf_counter() at the start of the block
+    return: counts
+    """
+    counts['profile']['sample'] = sample_time if isinstance(sample_time, list) else [sample_time]
+    counts['profile']['worker'] = str(os.getpid())
+    counts['profile']['busy'] = time.perf_counter() - start
+    counts['profile']['finished'] = time.time()
+    return counts
+
+# number of shots sampled and decoded at once in a chunk (see count_chunk)
+CHUNK_BLOCK_SIZE = 256
+
+def count_chunk(code,decoder,error_model,error_probability,probability_distribution,n_shots,rng,
+                cache=None,profile=False,block_size=CHUNK_BLOCK_SIZE):
+    """
+    Sample, decode and check a chunk of errors block by block, so that the memory of a worker
+    does not grow with the size of its chunks. The blocks are drawn one after the other from the
+    stream of the chunk, so the errors are those of sampling the whole chunk at once.
+    code: XZZX code
+    decoder: XZZX MPS decoder
+    error_model: error model used in simulation
+    error_probability: error probability parameter used in simulation
+    probability_distribution: error_model.probability_distribution(error_probability)
+    n_shots: number of shots of the chunk
+    rng: random stream of the chunk (see chunk_rng)
+    cache: optional DecodeCache of this point
+    profile: if True, the seconds spent on each stage are returned as counts['profile'], with
+        one 'sample' timing per block (see profile_block)
+    block_size: number of errors sampled at once
+    return: a dictionary of counters of this chunk
+    """
+    counts = {}
+    for block_start in range(0, n_shots, block_size):
+        block_time_start = time.perf_counter()
+        errors = sample_errors(code.n_k_d[0], probability_distribution, min(block_size, n_shots - block_start),
+                               rng, packed=True)
+        sample_time = time.perf_counter() - block_time_start
+        block_counts = count_block(code, decoder, error_model, error_probability, errors, cache, profile)
+        if profile:
+            block_counts['profile']['sample'] = [sample_time]
+        for name, value in block_counts.items():
+            if name in ('decode_cache', 'profile'):
+                merged = counts.setdefault(name, {})
+                for key, item in value.items():
+                    merged[key] = merged.get(key, [] if name == 'profile' else 0) + item
+            else:
+                counts[name] = counts.get(name, 0) + value
+    return counts
+
+# stages of the hot path timed by profiling, see add_profile
+PROFILE_STAGES = ['sample', 'syndrome', 'decode', 'verify', 'ipc']
+
+def add_profile(runs_data,profile):
+    """
+    Add the stage timings of a block (see profile_block) to the profile of running data. Each
+    stage keeps its total seconds and all timings until finish_profile summarizes them. The
+    timings of 'decode' are per shot, those of other stages per block, and 'ipc' is the time
+    from the end of a block in a worker to its result being added in the parent process.
+    runs_data: a dictionary with running data
+    profile: the 'profile' of the counters of a block
+    return: none
+    """
+    summary = runs_data.setdefault('profile', {'stages': {}, 'workers': {}})
+    for stage in PROFILE_STAGES:
+        if stage in profile:
+            timings = summary['stages'].setdefault(stage, {'total': 0.0, 'timings': []})
+            timings['total'] += float(sum(profile[stage]))
+            timings['timings'].extend(profile[stage])
+    workers = summary['workers']
+    workers[profile['worker']] = workers.get(profile['worker'], 0.0) + profile['busy']
+
+def finish_profile(runs_data):
+    """
+    Summarize the profile of running data: for each stage, its total seconds, seconds per shot,
+    number of timings and their 50th, 90th and 99th percentiles and maximum, and for each worker
+    process its busy seconds and utilization, the fraction of wall time it was busy.
+    runs_data: a dictionary with running data, with 'profile' and 'wall_time'
+    return: none
+    """
+    profile = runs_data['profile']
+    for stage, timings in profile['stages'].items():
+        values = np.array(timings.pop('timings'), dtype=float)
+        timings['per_shot'] = timings['total'] / runs_data['n_run'] if runs_data['n_run'] else 0.0
+        timings['count'] = len(values)
+        if len(values):
+            timings.update(zip(['p50', 'p90', 'p99', 'max'], np.percentile(values, [50, 90, 99, 100]).tolist()))
+    profile['workers'] = {worker: {'busy': busy, 'utilization': busy / runs_data['wall_time'] if runs_data['wall_time'] else 0.0}
+                          for worker, busy in profile['workers'].items()}
+
+def new_runs_data(code,decoder,error_model,error_probability):
+    """
+    Initialize the dictionary of running data of one simulation point.
+    code: XZZX code
+    decoder: XZZX MPS decoder
+    error_model: error model used in simulation
+    error_probability: error probability parameter used in simulation
+    return: a dictionary with empty running data
+    """
+    return {
         'code': code.label,
         'n_k_d': code.n_k_d,
         'time_steps': 1, # 1 for ideal simulation
@@ -209,65 +599,50 @@ def run_multicore(code,decoder,error_model,error_probability,max_runs):
         'physical_error_rate': 0.0,
         'wall_time': 0.0,
     }
-    # count cpu cores
-    num_cores = multiprocessing.cpu_count()
-    # initialize rng
-    rng = np.random.default_rng()
-    # generate errors in advance to make sure all the errors are different (otherwise if directly generate error in
-    # sub function run_once, the errors are all identical)
-    error_paulis = []
-    for _ in range(max_runs):
-        # generate a random error
-        n_qubits = code.n_k_d[0]
-        error_pauli = ''.join(rng.choice(
-            ('I', 'X', 'Y', 'Z'),
-            size=n_qubits,
-            p=error_model.probability_distribution(error_probability)
-        ))
-        error_paulis.append(error_pauli)
-    
-    # create a Pool and run the sub function in parallel.
-    pool = multiprocessing.Pool(processes=num_cores)
-    results = [pool.apply_async(run_once,args=(index,code,decoder,
-                error_model,error_probability,error_paulis)) for index in range(max_runs)]
-    pool.close()
-    pool.join()
-    
-    # get the results from ApplyResult object
-    true_results = []
-    for result in results:
-        true_results.append(result.get()) 
-    
-    # update run counts
-    runs_data['n_run'] = int(len(true_results))
-    success, failure_x, failure_y, failure_z = 0, 0, 0, 0
-    error_weights = []  # list of error_weight from current run
-    for result in true_results:
-        success += int(result[0])
-        error_weights.append(int(result[1]))
-        failure_x += int(result[2])
-        failure_y += int(result[3])
-        failure_z += int(result[4])
-    runs_data['n_success'] = success
+
+def add_counts(runs_data,counts):
+    """
+    Add the counters of a chunk to running data.
+    runs_data: a dictionary with running data
+    counts: a dictionary of counters, as returned by run_chunk
+    return: none
+    """
+    runs_data['n_run'] += counts['n_run']
+    runs_data['n_success'] += counts['n_success']
     runs_data['n_fail'] = runs_data['n_run'] - runs_data['n_success']
-    runs_data['n_xfail'] = failure_x
-    runs_data['n_yfail'] = failure_y
-    runs_data['n_zfail'] = failure_z
-    # error weight statistics
-    runs_data['error_weight_total'] = sum(error_weights)
-    runs_data['error_weight_pvar'] = statistics.pvariance(error_weights)
+    runs_data['n_xfail'] += counts['n_xfail']
+    runs_data['n_yfail'] += counts['n_yfail']
+    runs_data['n_zfail'] += counts['n_zfail']
+    runs_data['error_weight_total'] += counts['error_weight_total']
+    if 'decode_cache' in counts:
+        cache_stats = runs_data.setdefault('decode_cache', {name: 0 for name in counts['decode_cache']})
+        for name, value in counts['decode_cache'].items():
+            cache_stats[name] += value
+    if 'profile' in counts:
+        add_profile(runs_data, counts['profile'])
+
+def finish_runs_data(runs_data,error_weight_sqtotal,wall_time):
+    """
+    Add error weight and rate statistics to running data.
+    runs_data: a dictionary with running data
+    error_weight_sqtotal: sum of squared error weights of all runs
+    wall_time: wall time of the simulation point
+    return: none
+    """
+    # error weight statistics (population variance from the sums of weights and squared weights)
+    n_run = runs_data['n_run']
+    error_weight_total = runs_data['error_weight_total']
+    runs_data['error_weight_pvar'] = (n_run*error_weight_sqtotal - error_weight_total**2) / n_run**2
 
     # record wall_time
-    runs_data['wall_time'] = time.perf_counter() - wall_time_start
+    runs_data['wall_time'] = wall_time
 
     # add rate statistics
     time_steps = runs_data['time_steps']
-    n_run = runs_data['n_run']
     n_fail = runs_data['n_fail']
     n_xfail = runs_data['n_xfail']
     n_yfail = runs_data['n_yfail']
     n_zfail = runs_data['n_zfail']
-    error_weight_total = runs_data['error_weight_total']
     code_n_qubits = runs_data['n_k_d'][0]
 
     runs_data['logical_failure_rate'] = n_fail / n_run
@@ -275,103 +650,2475 @@ def run_multicore(code,decoder,error_model,error_probability,max_runs):
     runs_data['logicaly_failure_rate'] = n_yfail / n_run
     runs_data['logicalz_failure_rate'] = n_zfail / n_run
     runs_data['physical_error_rate'] = error_weight_total / code_n_qubits / time_steps / n_run
-    
+
+    # summarize stage timings
+    if 'profile' in runs_data:
+        finish_profile(runs_data)
+
+def binomial_interval(n_fail,n_run,z=1.96):
+    """
+    Wilson score interval of a failure rate.
+    n_fail: number of failures
+    n_run: number of runs
+    z: number of standard deviations of the interval (1.96 for 95% confidence)
+    return: a list of lower and upper bounds of the failure rate
+    """
+    if not n_run:
+        return [0.0, 1.0]
+    rate = n_fail / n_run
+    center = (rate + z**2 / (2 * n_run)) / (1 + z**2 / n_run)
+    half_width = z * np.sqrt(rate * (1 - rate) / n_run + z**2 / (4 * n_run**2)) / (1 + z**2 / n_run)
+    return [float(max(0.0, center - half_width)), float(min(1.0, center + half_width))]
+
+def converged(runs_data,target_rel_err=None,target_abs_err=None,min_runs=0):
+    """
+    Check whether the total and logical X, Y and Z failure rates of running data are known
+    precisely enough. A rate is precise enough if the half width of its 95% binomial confidence
+    interval is at most target_abs_err, or at most target_rel_err times the rate. A channel
+    without failures can only meet an absolute target.
+    runs_data: a dictionary with running data
+    target_rel_err: target relative half width of the confidence intervals
+    target_abs_err: target absolute half width of the confidence intervals
+    min_runs: minimal number of runs before the targets are checked
+    return: True if all four failure rates meet a target
+    """
+    if target_rel_err is None and target_abs_err is None:
+        return False
+    n_run = runs_data['n_run']
+    if n_run < max(min_runs, 1):
+        return False
+    for key in ('n_fail', 'n_xfail', 'n_yfail', 'n_zfail'):
+        low, high = binomial_interval(runs_data[key], n_run)
+        half_width = (high - low) / 2
+        rate = runs_data[key] / n_run
+        if not ((target_abs_err is not None and half_width <= target_abs_err)
+                or (target_rel_err is not None and half_width <= target_rel_err * rate)):
+            return False
+    return True
+
+def add_adaptive_data(runs_data,target_rel_err,target_abs_err,min_runs):
+    """
+    Record the targets of adaptive sampling, if any, in running data.
+    return: none
+    """
+    if target_rel_err is None and target_abs_err is None:
+        return
+    runs_data['adaptive'] = {
+        'target_rel_err': target_rel_err,
+        'target_abs_err': target_abs_err,
+        'min_runs': min_runs,
+        'converged': converged(runs_data, target_rel_err, target_abs_err, min_runs),
+    }
+
+def point_progress(runs_data,max_runs,elapsed,finished=False,z=1.96):
+    """
+    Progress of a simulation point for a status file.
+    runs_data: a dictionary with running data, possibly not finished
+    max_runs: number of runs planned for the point
+    elapsed: seconds since the point started
+    finished: whether the point is finished
+    z: number of standard deviations of the confidence intervals
+    return: a dictionary with the point, 'n_run', 'max_runs', 'shots_per_sec', 'eta' (seconds
+        left at the current speed), and for each channel the number of failures, rate and interval
+    """
+    n_run = runs_data['n_run']
+    speed = n_run / elapsed if elapsed > 0 else 0.0
+    progress = {
+        'code': runs_data['code'],
+        'decoder': runs_data['decoder'],
+        'error_model': runs_data.get('error_model'),
+        'error_probability': runs_data['error_probability'],
+        'n_run': n_run,
+        'max_runs': max_runs,
+        'finished': finished,
+        'elapsed': elapsed,
+        'shots_per_sec': speed,
+        'eta': 0.0 if finished else ((max_runs - n_run) / speed if speed else None),
+    }
+    for channel, count in (('total', 'n_fail'), ('x', 'n_xfail'), ('y', 'n_yfail'), ('z', 'n_zfail')):
+        n_fail = runs_data[count]
+        progress[channel] = {'n_fail': n_fail, 'rate': n_fail / n_run if n_run else None,
+                             'interval': binomial_interval(n_fail, n_run, z)}
+    return progress
+
+def save_status(filename,points_progress,elapsed,resumed_runs=0):
+    """
+    Write the progress of a simulation or sweep to a status file, which format_status and the
+    'status' command read. The file is replaced atomically, so it can be read at any time.
+    filename: the name or relative path of the status file
+    points_progress: list of point_progress of all points
+    elapsed: seconds since the sweep started or was resumed
+    resumed_runs: number of runs of all points done before the sweep was resumed, which do not
+        count towards the speed
+    return: the status, a dictionary with the 'points', the totals of the sweep 'n_run',
+        'max_runs', 'shots_per_sec' and 'eta', and the 'time' it was written
+    """
+    n_run = sum(point['n_run'] for point in points_progress)
+    # finished points need no more runs, even if they stopped on a target before max_runs
+    max_runs = sum(point['n_run'] if point['finished'] else point['max_runs'] for point in points_progress)
+    speed = (n_run - resumed_runs) / elapsed if elapsed > 0 else 0.0
+    status = {
+        'time': time.time(),
+        'elapsed': elapsed,
+        'n_run': n_run,
+        'max_runs': max_runs,
+        'shots_per_sec': speed,
+        'eta': (max_runs - n_run) / speed if speed else None,
+        'finished': all(point['finished'] for point in points_progress),
+        'points': points_progress,
+    }
+    _write_atomic(filename, json.dumps(status) + '\n')
+    return status
+
+def _format_seconds(seconds):
+    """
+    Format a duration as h:mm:ss, or '?' if unknown.
+    """
+    if seconds is None:
+        return '?'
+    seconds = int(round(seconds))
+    return '{}:{:02d}:{:02d}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+def format_status(status):
+    """
+    Format a status written by save_status as a table, one line per point.
+    status: a dictionary, as returned by save_status
+    return: a string
+    """
+    lines = ['sweep: {}/{} shots, {:.1f} shots/s, elapsed {}, eta {}{}'.format(
+        status['n_run'], status['max_runs'], status['shots_per_sec'], _format_seconds(status['elapsed']),
+        _format_seconds(status['eta']), ', finished' if status['finished'] else '')]
+    for point in status['points']:
+        rate = point['total']['rate']
+        low, high = point['total']['interval']
+        lines.append('{:<24} p={:<8.5g} {:>8}/{:<8} {:>8.2f} shots/s  eta {:>9}  fail {} ({}) [{:.3g}, {:.3g}]  Z fail {}{}'.format(
+            point['code'], point['error_probability'], point['n_run'], point['max_runs'], point['shots_per_sec'],
+            _format_seconds(point['eta']), point['total']['n_fail'], '?' if rate is None else '{:.4g}'.format(rate),
+            low, high, point['z']['n_fail'], '  done' if point['finished'] else ''))
+    return '\n'.join(lines)
+
+def watch_status(filename,follow=False,interval=5):
+    """
+    Print a status file written by run or run_sweep, and with follow, print it again whenever it
+    changes until the simulation is finished. If the file does not exist yet, e.g. because the
+    simulation is still starting, wait for it.
+    filename: the name or relative path of the status file
+    follow: whether to keep printing updates
+    interval: seconds between checks for updates
+    return: the last status read
+    """
+    if not os.path.exists(filename):
+        print('waiting for {}'.format(filename), flush=True)
+        while not os.path.exists(filename):
+            time.sleep(interval)
+    last_time = None
+    while True:
+        with open(filename, 'r', encoding='utf-8') as f:
+            status = json.load(f)
+        if status['time'] != last_time:
+            print(format_status(status), flush=True)
+            last_time = status['time']
+        if not follow or status['finished']:
+            return status
+        time.sleep(interval)
+
+def seed_entropy(seed=None):
+    """
+    Get the root entropy of a simulation. All random streams of a simulation are spawned
+    from it, so recording it is enough to replay the simulation exactly.
+    seed: an integer seed, a numpy SeedSequence, or None for fresh entropy from the OS
+    return: the entropy of the root SeedSequence
+    """
+    if isinstance(seed, np.random.SeedSequence):
+        return seed.entropy
+    return np.random.SeedSequence(seed).entropy
+
+def chunk_rng(entropy,point_index,chunk_index):
+    """
+    Random generator of one chunk (or block) of shots of one simulation point. Its SeedSequence is
+    the chunk_index-th child of the point_index-th child of the root, as spawned by
+    SeedSequence.spawn, so every chunk has an independent stream which does not depend on
+    which process samples it or in which order.
+    entropy: root entropy, from seed_entropy
+    point_index: index of the point in a sweep (0 for a single point)
+    chunk_index: index of the chunk in the point
+    return: numpy random generator
+    """
+    return np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=(point_index, chunk_index)))
+
+def add_seed_data(runs_data,entropy,point_index,chunk_size):
+    """
+    Record the seed metadata needed to replay a simulation point in running data.
+    return: none
+    """
+    runs_data['seed'] = {
+        'entropy': entropy,
+        'spawn_key': [point_index],
+        'chunk_size': chunk_size,
+    }
+
+def special_point(bias):
+    """
+    Special point of biased-depolarizing noise, where the error probability of the dominant Pauli
+    equals the probability of no error and the other two Paulis are equally likely.
+    bias: bias eta of the noise
+    return: the error probability p_s = (eta+1)/(2eta+1)
+    """
+    return (bias + 1) / (2 * bias + 1)
+
+def special_point_failure_rates(bias,distance):
+    """
+    Exact logical failure rates at the special point of a code with distance d against pure
+    errors along the bias axis.
+    bias: bias eta of the noise
+    distance: distance against errors along the bias axis
+    return: a list of the total failure rate 3/4 - 1/4*exp(-d/eta) and the failure rate of the
+        logical commuting with the bias axis 1/2 - 1/2*exp(-d/eta)
+    """
+    decay = np.exp(-distance / bias)
+    return [3/4 - 1/4*decay, 1/2 - 1/2*decay]
+
+def exact_failure_rates(code,error_model,error_probability,rel_tol=1e-9):
+    """
+    Exact logical failure rates at the special point. There, errors along the bias axis are
+    uniformly random, so the logical failure commuting with the bias axis is 1/2 - 1/2*exp(-d/eta),
+    with d the distance of the code against pure errors along the axis, the two other logical
+    failure rates are 1/2 and the total failure rate is 3/4 - 1/4*exp(-d/eta)
+    (see special_point_failure_rates).
+    Known cases are the XZZX code under Z-bias (d = d_Z) and the XY code (rotated planar code)
+    under Y-bias (d = d^2).
+    code: XZZX or XY code
+    error_model: biased-depolarizing error model
+    error_probability: error probability parameter
+    rel_tol: relative tolerance of matching the special point
+    return: a dictionary of exact 'logical_failure_rate', 'logicalx_failure_rate',
+        'logicaly_failure_rate' and 'logicalz_failure_rate', or None if unknown
+    """
+    bias = getattr(error_model, 'bias', None)
+    axis = getattr(error_model, 'axis', None)
+    if bias is None or not np.isclose(error_probability, special_point(bias), rtol=rel_tol, atol=0):
+        return None
+    family = code_family(code.label)
+    n_qubits, _, distance = code.n_k_d
+    if family == 'Rotated planar XZ' and axis == 'Z':
+        distance_axis = distance
+    elif family == 'Rotated planar' and axis == 'Y':
+        distance_axis = n_qubits
+    else:
+        return None
+    failure_rate, failure_rate_axis = special_point_failure_rates(bias, distance_axis)
+    rates = {'logicalx_failure_rate': 0.5, 'logicaly_failure_rate': 0.5, 'logicalz_failure_rate': 0.5}
+    rates['logical{}_failure_rate'.format(axis.lower())] = float(failure_rate_axis)
+    rates['logical_failure_rate'] = float(failure_rate)
+    return rates
+
+def exact_runs_data(code,decoder,error_model,error_probability):
+    """
+    Running data of a point whose failure rates are known exactly (see exact_failure_rates),
+    without simulation. n_run is 0 and the rates are the exact ones, also recorded in
+    runs_data['exact'].
+    code: XZZX or XY code
+    decoder: decoder the point would be simulated with
+    error_model: biased-depolarizing error model
+    error_probability: error probability parameter
+    return: a dictionary with running data
+    """
+    rates = exact_failure_rates(code, error_model, error_probability)
+    if rates is None:
+        raise ValueError('no exact failure rates of {} with {} at p={}'.format(
+            code.label, error_model.label, error_probability))
+    runs_data = new_runs_data(code, decoder, error_model, error_probability)
+    runs_data['error_weight_pvar'] = 0.0
+    runs_data['wall_time'] = 0.0
+    runs_data.update(rates)
+    runs_data['physical_error_rate'] = error_probability
+    runs_data['exact'] = rates
     return runs_data
 
-def save_simdata(filename,data):
+def validate_exact(code,decoder,error_model,max_runs=1000,z=3.0,seed=None,**kwargs):
     """
-    Save the simulation result(s) of qecsim to local pc.
-    filename: the name or relative path of saved file (format:"xxx.json").
-    data: the data needed saving. It is a list of dictionaries.
+    Check a simulation against the exact failure rates at the special point: a small batch is
+    run and each of the total and logical X, Y and Z failure rates must lie within the
+    binomial confidence interval of the batch.
+    code: XZZX or XY code
+    decoder: decoder to check
+    error_model: biased-depolarizing error model
+    max_runs: number of runs of the batch
+    z: number of standard deviations of the confidence intervals
+    seed: root seed of the batch (default: fresh entropy)
+    kwargs: further arguments of run, e.g. block_size
+    return: a dictionary with 'passed', the 'runs_data' of the batch and, for each rate, its
+        'exact' value, 'interval' and whether it is 'within' the interval
+    """
+    error_probability = special_point(error_model.bias)
+    rates = exact_failure_rates(code, error_model, error_probability)
+    if rates is None:
+        raise ValueError('no exact failure rates of {} with {}'.format(code.label, error_model.label))
+    runs_data = run(code, decoder, error_model, error_probability, max_runs, seed=seed, **kwargs)
+    checks = {}
+    for name, count in (('logical_failure_rate', 'n_fail'), ('logicalx_failure_rate', 'n_xfail'),
+                        ('logicaly_failure_rate', 'n_yfail'), ('logicalz_failure_rate', 'n_zfail')):
+        interval = binomial_interval(runs_data[count], runs_data['n_run'], z)
+        checks[name] = {'exact': rates[name], 'interval': interval,
+                        'within': interval[0] <= rates[name] <= interval[1]}
+    runs_data['exact'] = rates
+    return {'passed': all(check['within'] for check in checks.values()), 'runs_data': runs_data, **checks}
+
+def point_key(code,decoder,error_model,error_probability):
+    """
+    Identify a simulation point by the labels of its models and its error probability.
+    return: a list of code label, n_k_d, decoder label, error model label and error probability
+    """
+    return [code.label, list(code.n_k_d), decoder.label, error_model.label, error_probability]
+
+def save_checkpoint(filename,checkpoint):
+    """
+    Save a checkpoint of a running simulation. The file is replaced atomically, so an
+    interruption while saving leaves the previous checkpoint intact.
+    filename: the name or relative path of checkpoint file.
+    checkpoint: a dictionary with the state of the simulation.
     return: none
     """
-    with open(filename,"w", encoding='utf-8') as f:
-        for dict in data:
-            f.write(json5.dumps(dict))
-            f.write("\n")
+    with open(filename+'.tmp',"w", encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+    os.replace(filename+'.tmp', filename)
 
-def load_simdata(filename):
+def load_checkpoint(filename,points,**settings):
     """
-    Load the file containing simulation result(s) of qecsim
-    filename: the name or relative path of saved file (format:"xxx.json").
-    return: data of simulation result(s). It is a list of dictionaries.
+    Load a checkpoint saved by run or run_sweep, if there is one.
+    filename: the name or relative path of checkpoint file.
+    points: list of (code, decoder, error_model, error_probability) being simulated
+    settings: settings the checkpoint must have been saved with, e.g. max_runs
+    return: a dictionary with the state of the simulation, or None if there is no checkpoint
     """
-    data = []
+    if not filename or not os.path.exists(filename):
+        return None
     with open(filename,"r", encoding='utf-8') as f:
-        for line in f:
-            data.append(json5.loads(line.rstrip(';\n')))
-    return data
+        checkpoint = json.load(f)
+    keys = [point_key(*point) for point in points]
+    if checkpoint['points'] != keys or any(checkpoint[k] != v for k, v in settings.items()):
+        raise ValueError('checkpoint {} does not belong to this simulation'.format(filename))
+    return checkpoint
 
-def reshape_data(data_name,data_num):
+def resume_entropy(filename,checkpoint,seed):
     """
-    Compose a series of data files into one data file. Each data file name should be like: data_name + data_num + '.json'.
-    data_name: the name of data file.
-    data_num: number of the data file series.
-    return: one data file which contains all simulation information of the data series.
+    Get the root entropy of a simulation resumed from a checkpoint. A simulation started without
+    seed continues with the entropy of the checkpoint.
+    filename: the name or relative path of checkpoint file.
+    checkpoint: a dictionary with the state of the simulation, from load_checkpoint
+    seed: the seed given when resuming
+    return: the entropy of the root SeedSequence
     """
-    # make a list store all data together
-    data_list = []
-    for i in range(data_num):
-        data_list.append(load_simdata(data_name+'{}'.format(i)+'.json'))
-    # example data file to extract simulation information
-    data_eg = load_simdata(data_name+"0.json")
-    # collect all data in one list
-    data = []
-    # compose simulation results of each run 
-    for i_run in range(len(data_eg)):
-        # initialize result dict
-        dict = {
-            'code': data_eg[i_run]['code'],
-            'n_k_d': data_eg[i_run]['n_k_d'],
-            'time_steps': 1, # 1 for ideal simulation
-            'decoder': data_eg[i_run]['decoder'],
-            'error_probability': data_eg[i_run]['error_probability'],
-            'measurement_error_probability': 0.0, # 0 for ideal simulation
-            'n_run': 0,
-            'n_success': 0,
-            'n_fail': 0,
-            'n_xfail' : 0,
-            'n_yfail' : 0,
-            'n_zfail' : 0,
-            'n_logical_commutations': None,
-            'custom_totals': None,
-            'error_weight_total': 0,
-            'error_weight_pvar': 0.0,
-            'logical_failure_rate': 0.0,
-            'physical_error_rate': 0.0,
-            'wall_time': 0.0,
-        }
-        # if there's 'error_model' key in data, add it into dict
-        if 'error_model' in data_eg[i_run].keys():
-            dict['error_model'] = data_eg[i_run]['error_model']
-        # compose simulation results
-        for i in range(data_num):
-            dict['n_run'] += (data_list[i][i_run])['n_run']
-            dict['n_success'] += (data_list[i][i_run])['n_success']
-            dict['n_fail'] += (data_list[i][i_run])['n_fail']
-            dict['n_xfail'] += (data_list[i][i_run])['n_xfail']
-            dict['n_yfail'] += (data_list[i][i_run])['n_yfail']
-            dict['n_zfail'] += (data_list[i][i_run])['n_zfail']
-            dict['error_weight_total'] += (data_list[i][i_run])['error_weight_total']
-            dict['error_weight_pvar'] += (data_list[i][i_run])['error_weight_pvar']
-            dict['wall_time'] += (data_list[i][i_run])['wall_time']
-        # add rate statistics
-        dict['error_weight_pvar'] = dict['error_weight_pvar']/data_num
-        time_steps = dict['time_steps']
-        n_run = dict['n_run']
-        n_fail = dict['n_fail']
-        n_xfail = dict['n_xfail']
-        n_yfail = dict['n_yfail']
-        n_zfail = dict['n_zfail']
-        error_weight_total = dict['error_weight_total']
-        code_n_qubits = dict['n_k_d'][0]
-
-        dict['logical_failure_rate'] = n_fail / n_run
-        dict['logicalx_failure_rate'] = n_xfail / n_run
-        dict['logicaly_failure_rate'] = n_yfail / n_run
-        dict['logicalz_failure_rate'] = n_zfail / n_run
-        dict['physical_error_rate'] = error_weight_total / code_n_qubits / time_steps / n_run
-
-        # add composed dict to list
-        data.append(dict)
-    return data
\ No newline at end of file
+    if seed is not None and seed_entropy(seed) != checkpoint['entropy']:
+        raise ValueError('checkpoint {} was saved with another seed'.format(filename))
+    return checkpoint['entropy']
+
+def run(code,decoder,error_model,error_probability,max_runs,block_size=256,
+        checkpoint=None,checkpoint_interval=600,target_rel_err=None,target_abs_err=None,min_runs=0,
+        seed=None,decode_cache=0,profile=False,status=None,status_interval=10):
+    """
+    This is a packaged code sequence for running simulation max_runs times 
+    with recording the failure rate for each logical operator, and returns to a 
+    dictionary of running data.
+    code: XZZX code
+    decoder: XZZX MPS decoder
+    error_model: error model used in simulation
+    error_probability: error probability parameter used in simulation
+    max_runs: number of simulation running times
+    block_size: number of errors sampled at once. Each block has its own random stream (see chunk_rng),
+        so run and run_multicore with the same seed and chunk_size=block_size give the same result.
+    checkpoint: if given, the counters and seed are saved to this file every checkpoint_interval
+        seconds, and a simulation interrupted before is resumed from it. The file is removed at the end.
+    checkpoint_interval: seconds between two checkpoints
+    target_rel_err, target_abs_err: if given, stop as soon as the total and logical X, Y and Z
+        failure rates meet the target width of their confidence intervals (see converged), with
+        max_runs as the maximal number of runs
+    min_runs: minimal number of runs before stopping on a target
+    seed: root seed of the random streams, recorded in runs_data['seed'] (default: fresh entropy)
+    decode_cache: if not 0, cache the recoveries of up to this many syndromes (see DecodeCache),
+        with hits and misses recorded in runs_data['decode_cache']
+    profile: if True, time each stage of the hot path and record the summary in runs_data['profile']
+        (see add_profile and finish_profile). If a function, it is also called as
+        profile(runs_data, block_profile) after each block.
+    status: if given, the progress, speed, failure rates and remaining time are written to this file
+        every status_interval seconds and at the end (see save_status and watch_status)
+    status_interval: seconds between two writes of the status file
+    return: a dictionary with running data
+    """
+    wall_time_start = time.perf_counter()
+    # initialize runs_data
+    runs_data = new_runs_data(code, decoder, error_model, error_probability)
+    error_weight_sqtotal = 0
+    cache = DecodeCache(decode_cache, point_key(code, decoder, error_model, error_probability)) if decode_cache else None
+
+    # initialize seed
+    entropy = seed_entropy(seed)
+
+    # resume from checkpoint
+    saved = load_checkpoint(checkpoint, [(code,decoder,error_model,error_probability)],
+                            max_runs=max_runs, block_size=block_size)
+    if saved is not None:
+        entropy = resume_entropy(checkpoint, saved, seed)
+        runs_data.update(saved['runs_data'], n_k_d=code.n_k_d)
+        error_weight_sqtotal = saved['error_weight_sqtotal']
+        wall_time_start -= saved['wall_time']
+    checkpoint_time = time.perf_counter()
+    status_start = status_time = time.perf_counter()
+    resumed_runs = runs_data['n_run']
+
+    # the error distribution is computed once for this error probability
+    n_qubits = code.n_k_d[0]
+    probability_distribution = error_model.probability_distribution(error_probability)
+
+    # each error probability is simulated max_run times, errors are sampled block by block
+    for block_start in range(runs_data['n_run'], max_runs, block_size):
+        block_time_start = time.perf_counter()
+        errors = sample_errors(n_qubits, probability_distribution, min(block_size, max_runs - block_start),
+                               chunk_rng(entropy, 0, block_start // block_size), packed=True)
+        sample_time = time.perf_counter() - block_time_start
+        counts = count_block(code, decoder, error_model, error_probability, errors, cache, bool(profile))
+        if profile:
+            profile_block(counts, sample_time, block_time_start)
+        # increment run counts
+        add_counts(runs_data, counts)
+        if callable(profile):
+            profile(runs_data, counts['profile'])
+        error_weight_sqtotal += counts['error_weight_sqtotal']
+        if checkpoint and time.perf_counter() - checkpoint_time > checkpoint_interval:
+            save_checkpoint(checkpoint, {
+                'points': [point_key(code, decoder, error_model, error_probability)],
+                'max_runs': max_runs,
+                'block_size': block_size,
+                'runs_data': runs_data,
+                'error_weight_sqtotal': error_weight_sqtotal,
+                'entropy': entropy,
+                'wall_time': time.perf_counter() - wall_time_start,
+            })
+            checkpoint_time = time.perf_counter()
+        if status and time.perf_counter() - status_time > status_interval:
+            save_status(status, [point_progress(runs_data, max_runs, time.perf_counter() - wall_time_start)],
+                        time.perf_counter() - status_start, resumed_runs)
+            status_time = time.perf_counter()
+        # stop early if the failure rates are precise enough
+        if converged(runs_data, target_rel_err, target_abs_err, min_runs):
+            break
+
+    # add error weight and rate statistics
+    finish_runs_data(runs_data, error_weight_sqtotal, time.perf_counter() - wall_time_start)
+    add_adaptive_data(runs_data, target_rel_err, target_abs_err, min_runs)
+    add_seed_data(runs_data, entropy, 0, block_size)
+    if status:
+        save_status(status, [point_progress(runs_data, max_runs, runs_data['wall_time'], True)],
+                    time.perf_counter() - status_start, resumed_runs)
+    if checkpoint and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    
+    return runs_data
+
+def weight_probabilities(n_qubits,error_probability):
+    """
+    Probability of each error weight, i.e. the binomial distribution of the number of qubits
+    with an error.
+    n_qubits: number of physical qubits of the code
+    error_probability: probability of an error on one qubit, i.e. 1 - p_I
+    return: an array of length n_qubits+1 with the probability of weight 0 to n_qubits
+    """
+    weights = np.arange(n_qubits + 1)
+    log_binomial = np.array([math.lgamma(n_qubits + 1) - math.lgamma(w + 1) - math.lgamma(n_qubits - w + 1)
+                             for w in weights])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_probabilities = (log_binomial + weights * np.log(error_probability)
+                             + (n_qubits - weights) * np.log1p(-error_probability))
+    probabilities = np.exp(log_probabilities)
+    # p = 0 or 1 give 0*log(0) = nan
+    if error_probability in (0, 1):
+        probabilities = (weights == (n_qubits if error_probability else 0)).astype(float)
+    return probabilities
+
+def weight_strata(n_qubits,error_probability,tail=1e-12):
+    """
+    Error weights worth simulating: the most likely weights whose probabilities add up to at least
+    1 - tail.
+    n_qubits: number of physical qubits of the code
+    error_probability: probability of an error on one qubit, i.e. 1 - p_I
+    tail: probability of the weights left out
+    return: a sorted array of weights
+    """
+    probabilities = weight_probabilities(n_qubits, error_probability)
+    order = np.argsort(-probabilities, kind='stable')
+    n_strata = min(len(order), int(np.searchsorted(np.cumsum(probabilities[order]), 1 - tail)) + 1)
+    return np.sort(order[:n_strata])
+
+def stratified_estimate(runs_data):
+    """
+    Set the failure rates of stratified running data (see run_stratified) from the counts of its
+    strata. Each rate is the sum over weights w of P(w) times the failure rate at weight w, with
+    variance the sum of P(w)^2 f_w (1 - f_w) / n_w, recorded as e.g. 'logical_failure_rate_var'.
+    In the variance, f_w is the Jeffreys estimate (n_fail + 1/2) / (n_w + 1), so that strata with
+    few runs and no (or only) failures, e.g. one run, do not count as known exactly.
+    Weights which are not simulated count as no failure, so the rates are unbiased up to
+    runs_data['stratified']['truncated_probability'].
+    runs_data: a dictionary with running data and a 'stratified' entry
+    return: none
+    """
+    strata = runs_data['stratified']
+    probabilities = np.array(strata['probabilities'])
+    n_runs = np.array(strata['n_run'])
+    for rate, count in (('logical_failure_rate', 'n_fail'), ('logicalx_failure_rate', 'n_xfail'),
+                        ('logicaly_failure_rate', 'n_yfail'), ('logicalz_failure_rate', 'n_zfail')):
+        failure_rates = np.array(strata[count]) / n_runs
+        jeffreys_rates = (np.array(strata[count]) + 0.5) / (n_runs + 1)
+        runs_data[rate] = float(np.sum(probabilities * failure_rates))
+        runs_data[rate + '_var'] = float(np.sum(probabilities**2 * jeffreys_rates * (1 - jeffreys_rates) / n_runs))
+
+def run_stratified(code,decoder,error_model,error_probability,max_runs,weights=None,tail=1e-12,
+                   block_size=256,seed=None,decode_cache=0):
+    """
+    Estimate small failure rates by stratified sampling over the error weight. Errors of each weight
+    are sampled and decoded separately, with max_runs split evenly between the weights, and the
+    failure rates at each weight are combined with the binomial probabilities of the weights (see
+    stratified_estimate). Far below threshold, failures come from rare errors of high weight, which
+    get as many runs as the typical weights instead of almost none.
+    The running data has the schema of run: the counters are those of all simulated errors, while
+    the rates, their variances ('logical_failure_rate_var', ...), the physical error rate and the
+    error weight variance are those of the error model. The counters of each weight are recorded
+    in runs_data['stratified'].
+    code: XZZX code
+    decoder: XZZX MPS decoder
+    error_model: error model used in simulation
+    error_probability: error probability parameter used in simulation
+    max_runs: number of simulation running times
+    weights: the error weights to simulate (default: weight_strata with tail)
+    tail: probability of the weights left out if weights is not given
+    block_size: number of errors sampled at once
+    seed: root seed of the random streams (default: fresh entropy). The random stream of the
+        j-th block of weight w is chunk_rng(entropy, w, j).
+    decode_cache: if not 0, cache the recoveries of up to this many syndromes (see DecodeCache)
+    return: a dictionary with running data
+    """
+    wall_time_start = time.perf_counter()
+    runs_data = new_runs_data(code, decoder, error_model, error_probability)
+    error_weight_sqtotal = 0
+    cache = DecodeCache(decode_cache, point_key(code, decoder, error_model, error_probability)) if decode_cache else None
+    entropy = seed_entropy(seed)
+
+    n_qubits = code.n_k_d[0]
+    probability_distribution = error_model.probability_distribution(error_probability)
+    qubit_error_probability = 1 - probability_distribution[0]
+    probabilities = weight_probabilities(n_qubits, qubit_error_probability)
+    if weights is None:
+        weights = weight_strata(n_qubits, qubit_error_probability, tail)
+    weights = sorted(int(w) for w in weights)
+    if max_runs < len(weights):
+        raise ValueError('max_runs {} is less than the number of weights {}'.format(max_runs, len(weights)))
+    strata = {'weights': weights, 'probabilities': [float(probabilities[w]) for w in weights],
+              'n_run': [], 'n_fail': [], 'n_xfail': [], 'n_yfail': [], 'n_zfail': [],
+              'truncated_probability': float(max(0.0, 1 - probabilities[weights].sum()))}
+
+    for stratum_index, weight in enumerate(weights):
+        # runs are split evenly, the first weights get the remainder
+        stratum_runs = max_runs // len(weights) + (stratum_index < max_runs % len(weights))
+        stratum_counts = new_runs_data(code, decoder, error_model, error_probability)
+        for block_start in range(0, stratum_runs, block_size):
+            errors = sample_weight_errors(n_qubits, probability_distribution, weight,
+                                          min(block_size, stratum_runs - block_start),
+                                          chunk_rng(entropy, weight, block_start // block_size))
+            counts = count_block(code, decoder, error_model, error_probability, errors, cache)
+            add_counts(stratum_counts, counts)
+            add_counts(runs_data, counts)
+            error_weight_sqtotal += counts['error_weight_sqtotal']
+        for count in ('n_run', 'n_fail', 'n_xfail', 'n_yfail', 'n_zfail'):
+            strata[count].append(stratum_counts[count])
+
+    finish_runs_data(runs_data, error_weight_sqtotal, time.perf_counter() - wall_time_start)
+    # rates and error weight statistics of the error model rather than of the simulated errors
+    runs_data['stratified'] = strata
+    stratified_estimate(runs_data)
+    runs_data['error_weight_pvar'] = float(n_qubits * qubit_error_probability * (1 - qubit_error_probability))
+    runs_data['physical_error_rate'] = float(qubit_error_probability)
+    # the streams are spawned per weight instead of per point
+    runs_data['seed'] = {'entropy': entropy, 'spawn_key': ['weight'], 'chunk_size': block_size}
+    return runs_data
+
+def composition_probabilities(n_qubits,probability_distribution,compositions):
+    """
+    Probability of errors of each composition, i.e. the multinomial distribution of the numbers
+    of qubits with an X, Y and Z error.
+    n_qubits: number of physical qubits of the code
+    probability_distribution: (p_I, p_X, p_Y, p_Z) of one qubit
+    compositions: list of (w, a_X, a_Y, a_Z)
+    return: an array of the probability of each composition
+    """
+    compositions = np.array(compositions, dtype=np.int64).reshape(-1, 4)
+    counts = np.column_stack((n_qubits - compositions[:, 0], compositions[:, 1:]))
+    log_multinomial = math.lgamma(n_qubits + 1) - np.array([sum(math.lgamma(a + 1) for a in row) for row in counts])
+    with np.errstate(divide='ignore'):
+        log_p = np.log(np.asarray(probability_distribution, dtype=float))
+    # 0*log(0) is 0
+    log_terms = np.where(counts > 0, counts * log_p, 0.0)
+    return np.exp(log_multinomial + log_terms.sum(axis=1))
+
+def composition_strata(n_qubits,probability_distribution,tail=1e-12):
+    """
+    Error compositions worth simulating: for each weight of weight_strata, the most likely
+    compositions whose probabilities add up to at least 1 - tail/2 of the probability of the weight.
+    n_qubits: number of physical qubits of the code
+    probability_distribution: (p_I, p_X, p_Y, p_Z) of one qubit
+    tail: probability of the compositions left out
+    return: a sorted list of (w, a_X, a_Y, a_Z)
+    """
+    strata = []
+    for weight in weight_strata(n_qubits, 1 - probability_distribution[0], tail / 2):
+        weight = int(weight)
+        a_x, a_y = np.triu_indices(weight + 1)
+        a_y = a_y - a_x
+        compositions = np.column_stack((np.full(len(a_x), weight), a_x, a_y, weight - a_x - a_y))
+        probabilities = composition_probabilities(n_qubits, probability_distribution, compositions)
+        order = np.argsort(-probabilities, kind='stable')
+        cumulative = np.cumsum(probabilities[order])
+        n_strata = min(len(order), int(np.searchsorted(cumulative, cumulative[-1] * (1 - tail / 2))) + 1)
+        strata.extend(tuple(int(a) for a in composition) for composition in compositions[order[:n_strata]])
+    return sorted(strata)
+
+def allocate_runs(probabilities,max_runs,min_runs=1):
+    """
+    Split runs between strata in proportion to their probabilities, with at least min_runs each.
+    probabilities: array of the probability of each stratum
+    max_runs: number of runs of all strata
+    min_runs: minimal number of runs of a stratum
+    return: an integer array of the runs of each stratum, which add up to max_runs
+    """
+    probabilities = np.asarray(probabilities, dtype=float)
+    extra_runs = max_runs - min_runs * len(probabilities)
+    if extra_runs < 0:
+        raise ValueError('max_runs {} is less than {} runs of each of {} strata'.format(
+            max_runs, min_runs, len(probabilities)))
+    shares = extra_runs * probabilities / probabilities.sum()
+    runs = np.floor(shares).astype(np.int64)
+    # the strata with the largest remainders get the runs left
+    runs[np.argsort(runs - shares, kind='stable')[:extra_runs - runs.sum()]] += 1
+    return runs + min_runs
+
+def reweight_compositions(runs_data,error_model,error_probability):
+    """
+    Failure rates of another error probability or bias from a decoding campaign of run_compositions,
+    without decoding again. Only the probabilities of the compositions change, see stratified_estimate.
+    The recoveries were decoded with the error model and probability of the campaign, so a decoder
+    that depends on them was mismatched to the new point; runs_data['reweighted'] records the
+    decoder's error model and probability and the mismatch of error probability and bias.
+    runs_data: running data returned by run_compositions (or by this function)
+    error_model: error model of the new point, e.g. with another bias
+    error_probability: error probability of the new point
+    return: a dictionary with running data of the new point
+    """
+    reweighted = json.loads(json.dumps(runs_data))
+    strata = reweighted['stratified']
+    probability_distribution = error_model.probability_distribution(error_probability)
+    probabilities = composition_probabilities(reweighted['n_k_d'][0], probability_distribution, strata['compositions'])
+    strata['probabilities'] = probabilities.tolist()
+    strata['truncated_probability'] = float(max(0.0, 1 - probabilities.sum()))
+    stratified_estimate(reweighted)
+    qubit_error_probability = 1 - probability_distribution[0]
+    reweighted['error_model'] = error_model.label
+    reweighted['error_probability'] = error_probability
+    reweighted['physical_error_rate'] = float(qubit_error_probability)
+    reweighted['error_weight_pvar'] = float(reweighted['n_k_d'][0] * qubit_error_probability * (1 - qubit_error_probability))
+    decoding = runs_data.get('reweighted', {
+        'decoder_error_model': runs_data.get('error_model'),
+        'decoder_error_probability': runs_data['error_probability'],
+    })
+    decoder_bias = _label_value(decoding['decoder_error_model'], 'bias', float('nan'))
+    reweighted['reweighted'] = {
+        'decoder_error_model': decoding['decoder_error_model'],
+        'decoder_error_probability': decoding['decoder_error_probability'],
+        'error_probability_mismatch': error_probability - decoding['decoder_error_probability'],
+        'bias_mismatch': _label_value(error_model.label, 'bias', float('nan')) - decoder_bias,
+    }
+    return reweighted
+
+def run_compositions(code,decoder,error_model,error_probability,max_runs,compositions=None,targets=None,
+                     tail=1e-12,min_stratum_runs=10,max_strata=None,block_size=256,seed=None,decode_cache=0):
+    """
+    Decoding campaign stratified over the error composition (w, a_X, a_Y, a_Z), the numbers of
+    qubits with an X, Y and Z error. The failure rates at each composition do not depend on the
+    error probability or bias, so one campaign gives the failure rates of a whole range of points
+    with reweight_compositions, e.g. a dense grid of p for a threshold fit. Errors are decoded
+    with error_model and error_probability, which should lie in the middle of the range.
+    The number of compositions grows as w^2 at each weight w, so only the most likely ones are
+    kept, at most max_strata, and the probability of the others is recorded in
+    runs_data['stratified']['truncated_probability'] (see reweight_compositions). The runs are split
+    in proportion to the probability of each composition, its largest over the targets, with at
+    least min_stratum_runs each (see allocate_runs). The running data has the schema of
+    run_stratified, with the compositions in runs_data['stratified']['compositions'], and the
+    rates of this point.
+    code: XZZX code
+    decoder: XZZX MPS decoder
+    error_model: error model the decoder is given
+    error_probability: error probability the decoder is given
+    max_runs: number of simulation running times
+    compositions: the compositions to simulate (default: the union of composition_strata of
+        the targets with tail)
+    targets: list of (error_model, error_probability) the campaign should cover
+        (default: this point only)
+    tail: probability of the compositions left out at each target if compositions is not given
+    min_stratum_runs: minimal number of runs of a composition
+    max_strata: maximal number of compositions if compositions is not given (default: half of
+        max_runs / min_stratum_runs, so that at least half of the runs are split by probability)
+    block_size: number of errors sampled at once
+    seed: root seed of the random streams (default: fresh entropy). The random stream of the
+        j-th block of the i-th composition is chunk_rng(entropy, i, j).
+    decode_cache: if not 0, cache the recoveries of up to this many syndromes (see DecodeCache)
+    return: a dictionary with running data
+    """
+    wall_time_start = time.perf_counter()
+    runs_data = new_runs_data(code, decoder, error_model, error_probability)
+    error_weight_sqtotal = 0
+    cache = DecodeCache(decode_cache, point_key(code, decoder, error_model, error_probability)) if decode_cache else None
+    entropy = seed_entropy(seed)
+
+    n_qubits = code.n_k_d[0]
+    distributions = [target_error_model.probability_distribution(target_error_probability)
+                     for target_error_model, target_error_probability in (targets or [(error_model, error_probability)])]
+    truncate = compositions is None
+    if truncate:
+        compositions = set()
+        for probability_distribution in distributions:
+            compositions.update(composition_strata(n_qubits, probability_distribution, tail))
+    compositions = sorted(tuple(int(a) for a in composition) for composition in compositions)
+    probabilities = np.max([composition_probabilities(n_qubits, probability_distribution, compositions)
+                            for probability_distribution in distributions], axis=0)
+    if max_strata is None:
+        max_strata = max(1, max_runs // (2 * min_stratum_runs))
+    if truncate and len(compositions) > max_strata:
+        kept = np.sort(np.argsort(-probabilities, kind='stable')[:max_strata])
+        logger.info('keeping the {} most likely of {} compositions'.format(max_strata, len(compositions)))
+        compositions = [compositions[i] for i in kept]
+        probabilities = probabilities[kept]
+    stratum_runs = allocate_runs(probabilities, max_runs, min_stratum_runs)
+    strata = {'compositions': [list(composition) for composition in compositions],
+              'n_run': [], 'n_fail': [], 'n_xfail': [], 'n_yfail': [], 'n_zfail': []}
+
+    for stratum_index, composition in enumerate(compositions):
+        stratum_counts = new_runs_data(code, decoder, error_model, error_probability)
+        for block_start in range(0, stratum_runs[stratum_index], block_size):
+            errors = sample_composition_errors(n_qubits, composition,
+                                               min(block_size, stratum_runs[stratum_index] - block_start),
+                                               chunk_rng(entropy, stratum_index, block_start // block_size))
+            counts = count_block(code, decoder, error_model, error_probability, errors, cache)
+            add_counts(stratum_counts, counts)
+            add_counts(runs_data, counts)
+            error_weight_sqtotal += counts['error_weight_sqtotal']
+        for count in ('n_run', 'n_fail', 'n_xfail', 'n_yfail', 'n_zfail'):
+            strata[count].append(stratum_counts[count])
+
+    finish_runs_data(runs_data, error_weight_sqtotal, time.perf_counter() - wall_time_start)
+    runs_data['stratified'] = strata
+    runs_data['seed'] = {'entropy': entropy, 'spawn_key': ['composition'], 'chunk_size': block_size}
+    reweighted = reweight_compositions(runs_data, error_model, error_probability)
+    reweighted['wall_time'] = runs_data['wall_time']
+    return reweighted
+
+# per-process state of run_multicore/run_sweep workers, filled once by the pool initializer
+_worker_state = {}
+# number of points whose DecodeCache a worker keeps. Points are run in order, so the caches of
+# the least recently run points belong to finished points and are dropped.
+WORKER_CACHE_POINTS = 4
+
+def _init_worker(points,decode_cache=0,contexts=None):
+    """
+    Pool initializer for 'run_sweep' function. The codes, decoders and error models of all
+    sweep points are sent to each worker once here instead of with every task.
+    points: list of (code, decoder, error_model, error_probability)
+    decode_cache: size of the DecodeCache of each point in each worker, 0 for no cache. Each worker
+        keeps the caches of the WORKER_CACHE_POINTS points it ran last.
+    contexts: if given, descriptors of the code contexts in shared memory (see share_code_contexts)
+    """
+    _worker_state['points'] = points
+    _worker_state['decode_cache'] = decode_cache
+    _worker_state['caches'] = collections.OrderedDict()
+    if contexts:
+        _worker_state['shared_blocks'] = attach_code_contexts([point[0] for point in points], contexts)
+
+def run_chunk(point_index,chunk_index,n_shots,entropy,profile=False):
+    """
+    This is a sub-function for 'run_sweep' function. It samples and runs a chunk of shots of
+    one sweep point in a worker and returns aggregated counters instead of per-shot results.
+    The errors are sampled in the worker from the stream of the chunk (see chunk_rng), block by
+    block (see count_chunk).
+    point_index: index of the sweep point in the points given to the pool initializer.
+    chunk_index: index of the chunk in the point.
+    n_shots: number of shots of this chunk.
+    entropy: root entropy of the simulation.
+    profile: if True, time the stages of the chunk (see profile_block)
+    return: a dictionary of counters of this chunk.
+    """
+    chunk_time_start = time.perf_counter()
+    code, decoder, error_model, error_probability = _worker_state['points'][point_index]
+    # the error distribution is computed once for each point in each worker
+    distributions = _worker_state.setdefault('distributions', {})
+    if point_index not in distributions:
+        distributions[point_index] = error_model.probability_distribution(error_probability)
+    cache = None
+    if _worker_state['decode_cache']:
+        caches = _worker_state['caches']
+        if point_index not in caches:
+            caches[point_index] = DecodeCache(
+                _worker_state['decode_cache'], point_key(code, decoder, error_model, error_probability))
+            if len(caches) > WORKER_CACHE_POINTS:
+                caches.popitem(last=False)
+        caches.move_to_end(point_index)
+        cache = caches[point_index]
+    counts = count_chunk(code, decoder, error_model, error_probability, distributions[point_index], n_shots,
+                         chunk_rng(entropy, point_index, chunk_index), cache, profile)
+    if profile:
+        profile_block(counts, counts['profile']['sample'], chunk_time_start)
+    return counts
+
+def sweep_points(codes,decoders,error_models,error_probabilities):
+    """
+    Build the grid of simulation points of a sweep.
+    codes: list of codes, e.g. XZZX codes of different distances
+    decoders: list of decoders, one for each code
+    error_models: list of error models, e.g. biased-depolarizing error models of different bias
+    error_probabilities: list of error probabilities
+    return: list of (code, decoder, error_model, error_probability)
+    """
+    return [(code,decoder,error_model,error_probability)
+            for code, decoder in zip(codes, decoders)
+            for error_model in error_models
+            for error_probability in error_probabilities]
+
+# largest default chunk size of run_sweep, so that a chunk of a long point is still checkpointed,
+# checked against targets and rescheduled in small steps
+MAX_CHUNK_SIZE = 10000
+
+def run_sweep(points,max_runs,filename=None,processes=None,chunk_size=None,
+              checkpoint=None,checkpoint_interval=600,target_rel_err=None,target_abs_err=None,min_runs=0,
+              seed=None,decode_cache=0,special_point_runs=None,profile=False,status=None,status_interval=10):
+    """
+    Run simulation max_runs times at each point of a sweep, with one worker pool for the
+    whole sweep. Chunks of all points are scheduled across the pool, and each finished
+    point is appended to the output file at once.
+    points: list of (code, decoder, error_model, error_probability), e.g. from sweep_points
+    max_runs: number of simulation running times of each point, or a list of them, one per point
+    filename: if given, the running data of each finished point is appended to this file
+    processes: number of worker processes (default: number of cpu cores)
+    chunk_size: number of shots sent to a worker per task (default: about 4 chunks per worker
+        and point, and at most MAX_CHUNK_SIZE)
+    checkpoint: if given, the counters of all points, the chunks in flight and the seed are saved
+        to this file every checkpoint_interval seconds and whenever a point finishes, and a sweep
+        interrupted before is resumed from it. The file is removed at the end.
+    checkpoint_interval: seconds between two checkpoints
+    target_rel_err, target_abs_err: if given, each point stops as soon as its total and logical X, Y
+        and Z failure rates meet the target width of their confidence intervals (see converged),
+        with max_runs as the maximal number of runs
+    min_runs: minimal number of runs of a point before stopping on a target
+    seed: root seed of the random streams (default: fresh entropy). Each chunk of each point has
+        its own stream spawned from it (see chunk_rng), recorded in runs_data['seed'].
+    decode_cache: if not 0, each worker caches the recoveries of up to this many syndromes of each
+        of the last points it ran (see DecodeCache and WORKER_CACHE_POINTS), with hits and misses recorded in runs_data['decode_cache']
+    special_point_runs: if given, points with exact failure rates (see exact_failure_rates) are run
+        at most this many times, with the exact rates recorded in runs_data['exact'] for comparison.
+        If 0, they are not simulated at all and their running data is exact_runs_data.
+    profile: if True, time each stage of the hot path in the workers, and the passing of results
+        back to the parent, and record the summary and the utilization of each worker in
+        runs_data['profile'] (see add_profile). If a function, it is also called as
+        profile(runs_data, chunk_profile) after each chunk added to a point.
+    status: if given, the progress, speed, failure rates and remaining time of each point and of the
+        whole sweep are written to this file every status_interval seconds, whenever a point
+        finishes and at the end (see save_status). It can be followed with watch_status, or
+        'python toolbox.py status FILE --follow'.
+    status_interval: seconds between two writes of the status file
+    return: a list of dictionaries with running data, in the order of points
+    """
+    # count cpu cores
+    num_cores = processes if processes else multiprocessing.cpu_count()
+    if np.iterable(max_runs):
+        max_runs = [int(runs) for runs in max_runs]
+    point_max_runs = max_runs if isinstance(max_runs, list) else [max_runs] * len(points)
+    if not chunk_size:
+        chunk_size = min(MAX_CHUNK_SIZE, max(1, -(-max(point_max_runs, default=0) // (4 * num_cores))))
+    # number of runs of each point, fewer at points with exact failure rates
+    exact_rates = [exact_failure_rates(code, error_model, error_probability) if special_point_runs is not None else None
+                   for code, decoder, error_model, error_probability in points]
+    point_runs = [runs if rates is None else min(runs, special_point_runs)
+                  for runs, rates in zip(point_max_runs, exact_rates)]
+    n_chunks = [-(-runs // chunk_size) for runs in point_runs]
+    # initialize seed
+    entropy = seed_entropy(seed)
+    # state of each point: running data, sum of squared error weights, number of chunks added to the
+    # running data, finished chunks waiting for the chunks before them, wall time so far and whether
+    # the point is finished and written to the output file. Chunks are added in order, so a point
+    # stops on a target at the same chunk however the pool schedules them.
+    states = [{
+        'runs_data': new_runs_data(code, decoder, error_model, error_probability),
+        'error_weight_sqtotal': 0,
+        'chunks_done': 0,
+        'held': {},
+        'wall_time': 0.0,
+        'written': False,
+    } for code, decoder, error_model, error_probability in points]
+    wall_time_starts = [None] * len(points)
+    # (point index, chunk index) of the next chunk to sample
+    position = [0, 0]
+    # chunks submitted but not finished, as (point index, chunk index)
+    in_flight = set()
+    # chunks lost by an interruption, to be submitted again
+    resubmit = []
+
+    # resume from checkpoint
+    saved = load_checkpoint(checkpoint, points, max_runs=max_runs, chunk_size=chunk_size,
+                            special_point_runs=special_point_runs)
+    if saved is not None:
+        entropy = resume_entropy(checkpoint, saved, seed)
+        for point_index, (state, saved_state) in enumerate(zip(states, saved['states'])):
+            saved_state['runs_data']['n_k_d'] = state['runs_data']['n_k_d']
+            saved_state['held'] = {int(chunk_index): counts for chunk_index, counts in saved_state['held']}
+            state.update(saved_state)
+            if (state['chunks_done'] or state['held']) and not state['written']:
+                wall_time_starts[point_index] = time.perf_counter() - state['wall_time']
+        position = saved['position']
+        resubmit = saved['in_flight']
+
+    def write_checkpoint():
+        for state, wall_time_start in zip(states, wall_time_starts):
+            if wall_time_start is not None and not state['written']:
+                state['wall_time'] = time.perf_counter() - wall_time_start
+        save_checkpoint(checkpoint, {
+            'points': [point_key(*point) for point in points],
+            'max_runs': max_runs,
+            'chunk_size': chunk_size,
+            'special_point_runs': special_point_runs,
+            'states': [dict(state, held=list(state['held'].items())) for state in states],
+            'position': position,
+            'entropy': entropy,
+            'in_flight': sorted(in_flight),
+        })
+
+    resumed_runs = sum(state['runs_data']['n_run'] for state in states)
+
+    def write_status():
+        progress = []
+        for point_index, state in enumerate(states):
+            if state['written']:
+                elapsed = state['runs_data']['wall_time']
+            elif wall_time_starts[point_index] is not None:
+                elapsed = time.perf_counter() - wall_time_starts[point_index]
+            else:
+                elapsed = 0.0
+            progress.append(point_progress(state['runs_data'], point_runs[point_index], elapsed, state['written']))
+        save_status(status, progress, time.perf_counter() - status_start, resumed_runs)
+
+    def chunks():
+        # chunks are produced lazily, and only their seeds are sent: the workers sample the errors
+        # themselves, so the parent never holds errors and decoding starts at once
+        for point_index, chunk_index in resubmit:
+            if not states[point_index]['written']:
+                yield point_index, chunk_index
+        while position[0] < len(points):
+            point_index, chunk_index = position
+            # skip the rest of a point which stopped on its target
+            if states[point_index]['written']:
+                position[:] = [point_index + 1, 0]
+                continue
+            # points not simulated are finished at once
+            if not n_chunks[point_index]:
+                state = states[point_index]
+                state['runs_data'] = exact_runs_data(*points[point_index])
+                if filename:
+                    append_simdata(filename, state['runs_data'])
+                state['written'] = True
+                continue
+            position[:] = ([point_index, chunk_index + 1] if chunk_index + 1 < n_chunks[point_index]
+                           else [point_index + 1, 0])
+            yield point_index, chunk_index
+
+    # create a Pool whose workers receive all codes, decoders and error models once, then run the
+    # chunks of all points. At most two chunks per worker are in flight, so a point stopping on its
+    # target wastes little work and the memory of the parent does not grow with max_runs.
+    finished = queue.Queue()
+    # the arrays of each code are built once in the parent and mapped by all workers
+    contexts, shared_blocks = share_code_contexts([point[0] for point in points])
+    try:
+        pool = multiprocessing.Pool(processes=num_cores,initializer=_init_worker,
+                                    initargs=(points,decode_cache,contexts))
+    except BaseException:
+        release_shared_memory(shared_blocks)
+        raise
+    try:
+        pending = chunks()
+        exhausted = False
+        checkpoint_time = status_start = status_time = time.perf_counter()
+        while not exhausted or in_flight:
+            while not exhausted and len(in_flight) < 2 * num_cores:
+                task = next(pending, None)
+                if task is None:
+                    exhausted = True
+                    break
+                point_index, chunk_index = task
+                if wall_time_starts[point_index] is None:
+                    wall_time_starts[point_index] = time.perf_counter()
+                in_flight.add((point_index, chunk_index))
+                n_shots = min(chunk_size, point_runs[point_index] - chunk_index * chunk_size)
+                pool.apply_async(run_chunk, args=(point_index, chunk_index, n_shots, entropy, bool(profile)),
+                                 callback=lambda counts, i=point_index, j=chunk_index: finished.put((i, j, counts, None)),
+                                 error_callback=lambda error, i=point_index, j=chunk_index: finished.put((i, j, None, error)))
+            if not in_flight:
+                break
+            point_index, chunk_index, counts, error = finished.get()
+            if error is not None:
+                raise error
+            in_flight.discard((point_index, chunk_index))
+            if profile:
+                counts['profile']['ipc'] = [time.time() - counts['profile']['finished']]
+            state = states[point_index]
+            # chunks coming back after their point stopped on its target are dropped
+            if state['written']:
+                continue
+            # sum up the counters returned by each chunk, in chunk order
+            state['held'][chunk_index] = counts
+            while state['chunks_done'] in state['held'] and not state['written']:
+                counts = state['held'].pop(state['chunks_done'])
+                add_counts(state['runs_data'], counts)
+                if callable(profile):
+                    profile(state['runs_data'], counts['profile'])
+                state['error_weight_sqtotal'] += counts['error_weight_sqtotal']
+                state['chunks_done'] += 1
+                if (state['chunks_done'] == n_chunks[point_index]
+                        or converged(state['runs_data'], target_rel_err, target_abs_err, min_runs)):
+                    finish_runs_data(state['runs_data'], state['error_weight_sqtotal'],
+                                     time.perf_counter() - wall_time_starts[point_index])
+                    add_adaptive_data(state['runs_data'], target_rel_err, target_abs_err, min_runs)
+                    add_seed_data(state['runs_data'], entropy, point_index, chunk_size)
+                    if exact_rates[point_index] is not None:
+                        state['runs_data']['exact'] = exact_rates[point_index]
+                    state['held'].clear()
+                    if filename:
+                        append_simdata(filename, state['runs_data'])
+                    state['written'] = True
+            if checkpoint and (state['written']
+                               or time.perf_counter() - checkpoint_time > checkpoint_interval):
+                write_checkpoint()
+                checkpoint_time = time.perf_counter()
+            if status and (state['written'] or time.perf_counter() - status_time > status_interval):
+                write_status()
+                status_time = time.perf_counter()
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        release_shared_memory(shared_blocks)
+    if status:
+        write_status()
+    if checkpoint and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+    return [state['runs_data'] for state in states]
+
+def run_multicore(code,decoder,error_model,error_probability,max_runs,processes=None,chunk_size=None,
+                  checkpoint=None,checkpoint_interval=600,target_rel_err=None,target_abs_err=None,min_runs=0,
+                  seed=None,decode_cache=0,profile=False,status=None,status_interval=10):
+    """
+    This is a packaged code sequence for running simulation max_runs times 
+    with recording the failure rate for each logical operator in multi-cores parallely, 
+    and returns to a dictionary of running data.
+    code: XZZX code
+    decoder: XZZX MPS decoder
+    error_model: error model used in simulation
+    error_probability: error probability parameter used in simulation
+    max_runs: number of simulation running times
+    processes: number of worker processes (default: number of cpu cores)
+    chunk_size: number of shots sent to a worker per task (default: as in run_sweep)
+    checkpoint: if given, the simulation is checkpointed to and resumed from this file (see run_sweep)
+    checkpoint_interval: seconds between two checkpoints
+    target_rel_err, target_abs_err: if given, stop as soon as the failure rates meet the target
+        width of their confidence intervals (see converged), with max_runs as the maximal number of runs
+    min_runs: minimal number of runs before stopping on a target
+    seed: root seed of the random streams, recorded in runs_data['seed'] (default: fresh entropy)
+    decode_cache: if not 0, each worker caches the recoveries of up to this many syndromes (see DecodeCache)
+    profile: if True or a function, time each stage of the hot path (see run_sweep)
+    status: if given, the progress of the simulation is written to this file (see run_sweep)
+    status_interval: seconds between two writes of the status file
+    return: a dictionary with running data
+    """
+    wall_time_start = time.perf_counter()
+    runs_data = run_sweep([(code,decoder,error_model,error_probability)],max_runs,
+                          processes=processes,chunk_size=chunk_size,
+                          checkpoint=checkpoint,checkpoint_interval=checkpoint_interval,
+                          target_rel_err=target_rel_err,target_abs_err=target_abs_err,min_runs=min_runs,
+                          seed=seed,decode_cache=decode_cache,profile=profile,
+                          status=status,status_interval=status_interval)[0]
+    # record wall_time, including pool startup and teardown
+    runs_data['wall_time'] = time.perf_counter() - wall_time_start
+    return runs_data
+
+def compact_simdata(filename):
+    """
+    Merge the shards of each simulation point of a file into one result, in order of first
+    appearance. Results of points with one shard are kept as they are, with their seed metadata.
+    The file is replaced atomically, and only if some point has several shards.
+    filename: the name or relative path of the file (format:"xxx.json")
+    return: data of merged simulation result(s). It is a list of dictionaries.
+    """
+    shards = {}
+    for run in iter_simdata(filename):
+        shards.setdefault(simdata_key(run), []).append(run)
+    data = []
+    for runs in shards.values():
+        merged = runs[0]
+        for run in runs[1:]:
+            merged = merge_runs_data(merged, run)
+        data.append(merged)
+    if any(len(runs) > 1 for runs in shards.values()):
+        _write_atomic(filename, ''.join(json5.dumps(run) + '\n' for run in data))
+    return data
+
+def run_incremental(points,max_runs,filename,seed=None,special_point_runs=None,
+                    target_rel_err=None,target_abs_err=None,min_runs=0,**kwargs):
+    """
+    Extend a sweep whose results are kept in a file. The results in the file are indexed by
+    simulation point (see simdata_key): missing points are run max_runs times, and points with
+    fewer runs are topped up to max_runs. The new results are appended to the file as they finish,
+    then each point is merged into one result (see compact_simdata). An interrupted extension is
+    resumed by calling this again, as the finished points are already in the file.
+    points: list of (code, decoder, error_model, error_probability), e.g. from sweep_points
+    max_runs: target number of runs of each point
+    filename: the name or relative path of the result file, created if needed
+    seed: root seed of the new runs (default: fresh entropy). It must differ from the seed of
+        the results it tops up, or the same shots would be run again.
+    special_point_runs: as in run_sweep; points with exact failure rates are topped up to this
+        many runs at most, and not at all if 0
+    target_rel_err, target_abs_err, min_runs: as in run_sweep. Points whose results already meet
+        the targets are skipped; the new runs of the other points stop on the targets by themselves.
+    kwargs: further arguments of run_sweep, e.g. processes or chunk_size. A checkpoint is only
+        needed to resume unfinished points, as finished points are kept in the file.
+    return: a dictionary with 'data', the merged results in the file, 'run', the indices of the
+        points which were run, and 'n_run', the number of new runs of each of them
+    """
+    existing = {}
+    if os.path.exists(filename):
+        existing = {simdata_key(run): run for run in compact_simdata(filename)}
+    entropy = seed_entropy(seed)
+    indices = []
+    n_runs = []
+    for point_index, (code, decoder, error_model, error_probability) in enumerate(points):
+        target = max_runs
+        if special_point_runs is not None and exact_failure_rates(code, error_model, error_probability) is not None:
+            target = min(max_runs, special_point_runs)
+        key = simdata_key(new_runs_data(code, decoder, error_model, error_probability))
+        runs_data = existing.get(key)
+        if runs_data is not None:
+            if (runs_data['n_run'] >= target
+                    or (runs_data['n_run'] and converged(runs_data, target_rel_err, target_abs_err, min_runs))):
+                continue
+            seeds = runs_data.get('seeds', [runs_data['seed']] if 'seed' in runs_data else [])
+            if seed is not None and entropy in [shard_seed['entropy'] for shard_seed in seeds]:
+                raise ValueError('{} at p={} in {} was run with the same seed'.format(
+                    runs_data['code'], error_probability, filename))
+            target -= runs_data['n_run']
+        indices.append(point_index)
+        n_runs.append(target)
+    if indices:
+        run_sweep([points[i] for i in indices], n_runs, filename=filename, seed=entropy,
+                  special_point_runs=special_point_runs, target_rel_err=target_rel_err,
+                  target_abs_err=target_abs_err, min_runs=min_runs, **kwargs)
+    data = compact_simdata(filename) if os.path.exists(filename) else []
+    return {'data': data, 'run': indices, 'n_run': n_runs}
+
+def peak_rss():
+    """
+    Peak resident memory of this process and of the largest of its finished child processes
+    (e.g. the workers of run_multicore), from getrusage. Not available on Windows.
+    return: a dictionary with 'self' and 'children' in MB
+    """
+    import resource
+    # ru_maxrss is in bytes on macOS and in kB elsewhere
+    scale = 2**-20 if sys.platform == 'darwin' else 2**-10
+    return {'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale}
+
+def benchmark_point(code,decoder,error_model,error_probability,n_shots,processes=0,seed=0,block_size=None):
+    """
+    Time the simulation of one point with the stage profile on (see finish_profile).
+    code: XZZX code
+    decoder: XZZX MPS decoder
+    error_model: error model used in simulation
+    error_probability: error probability parameter used in simulation
+    n_shots: number of shots to run
+    processes: 0 to run in this process with run, otherwise the number of workers of run_multicore
+    seed: root seed of the random streams, fixed so that each benchmark decodes the same errors
+    block_size: block size of run or chunk size of run_multicore (default: their defaults)
+    return: a dictionary with the point, 'shots_per_sec', 'wall_time', 'stages', the seconds per
+        shot of each stage, 'utilization', the mean utilization of the workers, and 'peak_rss',
+        the peak resident memory in MB of this process or of its largest worker
+    """
+    if processes:
+        runs_data = run_multicore(code, decoder, error_model, error_probability, n_shots,
+                                  processes=processes, chunk_size=block_size, seed=seed, profile=True)
+    else:
+        runs_data = run(code, decoder, error_model, error_probability, n_shots,
+                        block_size=block_size or 256, seed=seed, profile=True)
+    workers = runs_data['profile']['workers'].values()
+    return {
+        'code': runs_data['code'],
+        'd': code.n_k_d[2],
+        'decoder': runs_data['decoder'],
+        'error_model': runs_data['error_model'],
+        'error_probability': error_probability,
+        'processes': processes,
+        'n_run': runs_data['n_run'],
+        'wall_time': runs_data['wall_time'],
+        'shots_per_sec': runs_data['n_run'] / runs_data['wall_time'] if runs_data['wall_time'] else 0.0,
+        'stages': {stage: timings['per_shot'] for stage, timings in runs_data['profile']['stages'].items()},
+        'utilization': float(np.mean([worker['utilization'] for worker in workers])) if workers else 0.0,
+        'peak_rss': max(peak_rss().values()),
+    }
+
+def _benchmark_worker(results,args,kwargs):
+    results.put(benchmark_point(*args, **kwargs))
+
+def benchmark_isolated(*args,**kwargs):
+    """
+    Run benchmark_point in a fresh process, so that its peak memory is not inflated by the
+    benchmarks before it and its timings do not profit from their warm caches.
+    args, kwargs: arguments of benchmark_point
+    return: the result of benchmark_point
+    """
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=_benchmark_worker, args=(results, args, kwargs))
+    process.start()
+    try:
+        while True:
+            try:
+                return results.get(timeout=1)
+            except queue.Empty:
+                if not process.is_alive():
+                    raise RuntimeError('benchmark process exited with code {}'.format(process.exitcode))
+    finally:
+        process.join()
+
+def benchmark_key(result):
+    """
+    Key of a benchmark result, which matches it to its baseline.
+    result: a dictionary returned by benchmark_point
+    return: a string key
+    """
+    return '{} | {} | {} | p={} | processes={}'.format(result['code'], result['decoder'], result['error_model'],
+                                                      result['error_probability'], result['processes'])
+
+def scaling_efficiency(results):
+    """
+    Add the parallel scaling efficiency to benchmark results: the speed with n workers divided
+    by n times the speed of the same point with 1 worker (or in-process, without a 1-worker result).
+    results: list of dictionaries returned by benchmark_point
+    return: none; results with workers get 'scaling_efficiency'
+    """
+    serial = {}
+    for result in sorted(results, key=lambda result: result['processes'] != 1):
+        if result['processes'] <= 1:
+            serial.setdefault(benchmark_key(dict(result, processes=None)), result['shots_per_sec'])
+    for result in results:
+        speed = serial.get(benchmark_key(dict(result, processes=None)))
+        if result['processes'] and speed:
+            result['scaling_efficiency'] = result['shots_per_sec'] / (result['processes'] * speed)
+
+def compare_benchmarks(results,baseline,tolerance=0.2):
+    """
+    Flag the regressions of benchmark results against a stored baseline: a lower speed, more
+    seconds per shot in a stage, or a higher peak memory than the baseline by more than tolerance.
+    A stage is only flagged if it also grew by more than tolerance of the time per shot of all
+    stages, so that the noise of the short stages (e.g. sampling) is not flagged.
+    results: list of dictionaries returned by benchmark_point
+    baseline: list of dictionaries returned by benchmark_point earlier, e.g. loaded from a file
+    tolerance: relative change which is not flagged, to allow for the noise of the timings
+    return: a list of strings, one per regression
+    """
+    baseline = {benchmark_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        key = benchmark_key(result)
+        if key not in baseline:
+            continue
+        old = baseline[key]
+        if result['shots_per_sec'] < old['shots_per_sec'] * (1 - tolerance):
+            regressions.append('{}: {:.3g} shots/s, baseline {:.3g}'.format(key, result['shots_per_sec'], old['shots_per_sec']))
+        total = sum(old['stages'].values())
+        for stage, per_shot in result['stages'].items():
+            if (stage in old['stages'] and per_shot > old['stages'][stage] * (1 + tolerance)
+                    and per_shot - old['stages'][stage] > total * tolerance):
+                regressions.append('{}: {} {:.3g} s/shot, baseline {:.3g}'.format(key, stage, per_shot, old['stages'][stage]))
+        if result['peak_rss'] > old['peak_rss'] * (1 + tolerance):
+            regressions.append('{}: peak RSS {:.0f} MB, baseline {:.0f} MB'.format(key, result['peak_rss'], old['peak_rss']))
+    return regressions
+
+def publish_sweep(queue_dir,points,max_runs,unit_size,seed=None):
+    """
+    Publish a sweep to a directory-backed work queue, split into work units of unit_size shots of
+    one point. Workers on any host sharing the directory run the units with run_queue_worker, and
+    gather_queue merges their results. Unit k of point i samples its errors from chunk_rng(entropy, i, k),
+    so the gathered results are those of run_sweep with the same seed and chunk_size=unit_size.
+    queue_dir: the queue directory, created if needed
+    points: list of (code, decoder, error_model, error_probability), e.g. from sweep_points
+    max_runs: number of simulation running times of each point
+    unit_size: number of shots of each work unit
+    seed: root seed of the random streams (default: fresh entropy)
+    return: number of published work units
+    """
+    for sub_dir in ('pending', 'claimed', 'results'):
+        os.makedirs(os.path.join(queue_dir, sub_dir), exist_ok=True)
+    with open(os.path.join(queue_dir, 'points.pkl'), 'wb') as f:
+        pickle.dump(points, f)
+    with open(os.path.join(queue_dir, 'settings.json'), 'w', encoding='utf-8') as f:
+        json.dump({'entropy': seed_entropy(seed), 'max_runs': max_runs, 'unit_size': unit_size}, f)
+    n_units = 0
+    for point_index in range(len(points)):
+        for chunk_index, start in enumerate(range(0, max_runs, unit_size)):
+            unit = {'point_index': point_index, 'chunk_index': chunk_index,
+                    'n_shots': min(unit_size, max_runs - start)}
+            _write_atomic(os.path.join(queue_dir, 'pending', _unit_name(unit)), json.dumps(unit))
+            n_units += 1
+    return n_units
+
+def _unit_name(unit):
+    """
+    File name of a work unit.
+    """
+    return '{:05d}_{:06d}.json'.format(unit['point_index'], unit['chunk_index'])
+
+def _write_atomic(filename,text):
+    """
+    Write a text file so that other processes and hosts only ever see it complete.
+    """
+    tmp_filename = '{}.{}.{}.tmp'.format(filename, socket.gethostname(), os.getpid())
+    with open(tmp_filename, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_filename, filename)
+
+def _claim_unit(queue_dir):
+    """
+    Claim a pending work unit by renaming it into the claimed directory, which is atomic, so a
+    unit is claimed by one worker only. A lease file next to the claimed unit holds the owner.
+    The rename keeps the time the unit was published, so the claimed unit is touched at once,
+    or a unit published longer than a lease ago would look expired to requeue_expired.
+    return: the work unit, or None if there is no pending unit
+    """
+    for name in sorted(os.listdir(os.path.join(queue_dir, 'pending'))):
+        if not name.endswith('.json'):
+            continue
+        claimed = os.path.join(queue_dir, 'claimed', name)
+        try:
+            os.rename(os.path.join(queue_dir, 'pending', name), claimed)
+        except FileNotFoundError:
+            continue # claimed by another worker
+        os.utime(claimed)
+        _write_atomic(claimed[:-len('.json')] + '.lease',
+                      json.dumps({'host': socket.gethostname(), 'pid': os.getpid()}))
+        with open(claimed, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return None
+
+def requeue_expired(queue_dir,lease_time=600):
+    """
+    Put claimed work units back into the pending directory when neither their lease nor the unit
+    has been renewed for lease_time seconds, e.g. because their worker died.
+    queue_dir: the queue directory
+    lease_time: seconds after which a lease expires
+    return: number of requeued work units
+    """
+    n_requeued = 0
+    claimed_dir = os.path.join(queue_dir, 'claimed')
+    for name in os.listdir(claimed_dir):
+        if not name.endswith('.json'):
+            continue
+        lease = os.path.join(claimed_dir, name[:-len('.json')] + '.lease')
+        try:
+            last_renewal = max(os.path.getmtime(filename) for filename in (lease, os.path.join(claimed_dir, name))
+                               if os.path.exists(filename))
+            if time.time() - last_renewal < lease_time:
+                continue
+            os.rename(os.path.join(claimed_dir, name), os.path.join(queue_dir, 'pending', name))
+        except FileNotFoundError:
+            continue # finished or requeued meanwhile
+        if os.path.exists(lease):
+            os.remove(lease)
+        n_requeued += 1
+    return n_requeued
+
+def queue_status(queue_dir):
+    """
+    Count the work units of a queue.
+    queue_dir: the queue directory
+    return: a dictionary with the numbers of pending, claimed and done work units
+    """
+    def count(sub_dir):
+        return len([name for name in os.listdir(os.path.join(queue_dir, sub_dir)) if name.endswith('.json')])
+    return {'pending': count('pending'), 'claimed': count('claimed'), 'done': count('results')}
+
+def run_queue_worker(queue_dir,lease_time=600,poll_interval=10):
+    """
+    Run the work units of a queue until none is pending or claimed. Each result is written to the
+    results directory as a one-point data file. A unit is sampled and decoded block by block
+    (see count_chunk). While it runs, its lease and the claimed unit are touched every
+    lease_time/3 seconds; units of dead workers are requeued once their lease expires.
+    queue_dir: the queue directory, as created by publish_sweep
+    lease_time: seconds after which a lease expires
+    poll_interval: seconds to wait for claimed units of other workers to finish or expire
+    return: number of work units run by this worker
+    """
+    with open(os.path.join(queue_dir, 'points.pkl'), 'rb') as f:
+        points = pickle.load(f)
+    with open(os.path.join(queue_dir, 'settings.json'), 'r', encoding='utf-8') as f:
+        settings = json.load(f)
+    n_units = 0
+    while True:
+        unit = _claim_unit(queue_dir)
+        if unit is None:
+            if requeue_expired(queue_dir, lease_time):
+                continue
+            if not queue_status(queue_dir)['claimed']:
+                return n_units
+            time.sleep(poll_interval)
+            continue
+        name = _unit_name(unit)
+        claimed = os.path.join(queue_dir, 'claimed', name)
+        lease = claimed[:-len('.json')] + '.lease'
+        # renew the lease in the background while the unit runs
+        done = threading.Event()
+        def renew():
+            while not done.wait(lease_time / 3):
+                for filename in (lease, claimed):
+                    try:
+                        os.utime(filename)
+                    except FileNotFoundError:
+                        pass # requeued meanwhile
+        renewer = threading.Thread(target=renew, daemon=True)
+        renewer.start()
+        try:
+            wall_time_start = time.perf_counter()
+            code, decoder, error_model, error_probability = points[unit['point_index']]
+            counts = count_chunk(code, decoder, error_model, error_probability,
+                                 error_model.probability_distribution(error_probability), unit['n_shots'],
+                                 chunk_rng(settings['entropy'], unit['point_index'], unit['chunk_index']))
+            runs_data = new_runs_data(code, decoder, error_model, error_probability)
+            add_counts(runs_data, counts)
+            finish_runs_data(runs_data, counts['error_weight_sqtotal'], time.perf_counter() - wall_time_start)
+        finally:
+            done.set()
+            renewer.join()
+        _write_atomic(os.path.join(queue_dir, 'results', name), json5.dumps(runs_data) + '\n')
+        for filename in (claimed, lease):
+            if os.path.exists(filename):
+                os.remove(filename)
+        n_units += 1
+
+def run_queue_local(queue_dir,processes=None,lease_time=600,poll_interval=10):
+    """
+    Run the work units of a queue with several worker processes on this host.
+    queue_dir: the queue directory, as created by publish_sweep
+    processes: number of worker processes (default: number of cpu cores)
+    lease_time: seconds after which a lease expires
+    poll_interval: seconds to wait for claimed units of other workers to finish or expire
+    return: none
+    """
+    num_cores = processes if processes else multiprocessing.cpu_count()
+    workers = [multiprocessing.Process(target=run_queue_worker, args=(queue_dir, lease_time, poll_interval))
+               for _ in range(num_cores)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+def gather_queue(queue_dir,filename=None):
+    """
+    Merge the results of the work units of a queue into one result per point, like reshape_data
+    does for a series of data files.
+    queue_dir: the queue directory
+    filename: if given, the merged results are saved to this file with save_simdata
+    return: data of merged simulation result(s), in the order of points. Points without any
+        finished work unit are left out.
+    """
+    with open(os.path.join(queue_dir, 'points.pkl'), 'rb') as f:
+        points = pickle.load(f)
+    with open(os.path.join(queue_dir, 'settings.json'), 'r', encoding='utf-8') as f:
+        settings = json.load(f)
+    merged = {simdata_key(run): run
+              for run in merge_simdata(os.path.join(queue_dir, 'results', '*.json'))}
+    data = []
+    for point_index, point in enumerate(points):
+        runs_data = merged.get(simdata_key(new_runs_data(*point)))
+        if runs_data is not None:
+            add_seed_data(runs_data, settings['entropy'], point_index, settings['unit_size'])
+            data.append(runs_data)
+    if filename:
+        save_simdata(filename, data)
+    return data
+
+def save_simdata(filename,data):
+    """
+    Save the simulation result(s) of qecsim to local pc.
+    filename: the name or relative path of saved file (format:"xxx.json").
+    data: the data needed saving. It is a list of dictionaries.
+    return: none
+    """
+    with open(filename,"w", encoding='utf-8') as f:
+        for dict in data:
+            f.write(json5.dumps(dict))
+            f.write("\n")
+
+def append_simdata(filename,runs_data):
+    """
+    Append the simulation result of one point to a file in the format of save_simdata.
+    filename: the name or relative path of saved file (format:"xxx.json").
+    runs_data: a dictionary with running data.
+    return: none
+    """
+    with open(filename,"a", encoding='utf-8') as f:
+        f.write(json5.dumps(runs_data))
+        f.write("\n")
+
+def load_simdata(filename):
+    """
+    Load the file containing simulation result(s) of qecsim
+    filename: the name or relative path of saved file (format:"xxx.json").
+    return: data of simulation result(s). It is a list of dictionaries.
+    """
+    data = []
+    with open(filename,"r", encoding='utf-8') as f:
+        for line in f:
+            data.append(json5.loads(line.rstrip(';\n')))
+    return data
+
+# columns of a simulation table, one row per simulation point
+SIMTABLE_COLUMNS = [
+    ('code', str),
+    ('decoder', str),
+    ('error_model', str),
+    ('n', np.int64),
+    ('k', np.int64),
+    ('d', np.int64),
+    ('bias', np.float64), # bias of the error model, nan if not in its label
+    ('bias_axis', str), # axis of the bias, '' if not in its label
+    ('chi', np.int64), # bond dimension of the decoder, -1 if not in its label
+    ('time_steps', np.int64),
+    ('error_probability', np.float64),
+    ('measurement_error_probability', np.float64),
+    ('n_run', np.int64),
+    ('n_success', np.int64),
+    ('n_fail', np.int64),
+    ('n_xfail', np.int64),
+    ('n_yfail', np.int64),
+    ('n_zfail', np.int64),
+    ('error_weight_total', np.int64),
+    ('error_weight_pvar', np.float64),
+    ('logical_failure_rate', np.float64),
+    ('logicalx_failure_rate', np.float64),
+    ('logicaly_failure_rate', np.float64),
+    ('logicalz_failure_rate', np.float64),
+    ('physical_error_rate', np.float64),
+    ('wall_time', np.float64),
+    # variances of the rates, binomial r*(1-r)/n_run unless given (see run_stratified)
+    ('logical_failure_rate_var', np.float64),
+    ('logicalx_failure_rate_var', np.float64),
+    ('logicaly_failure_rate_var', np.float64),
+    ('logicalz_failure_rate_var', np.float64),
+]
+
+def _label_value(label,name,default):
+    """
+    Extract a numeric parameter such as 'bias=300' or 'chi=8' from a model label.
+    """
+    match = re.search(r'\b{}=([-+0-9.eE]+)'.format(name), label or '')
+    return type(default)(match.group(1)) if match else default
+
+def simdata_to_table(data,source=None):
+    """
+    Transform simulation result(s) into a table with one typed column per field.
+    data: data of simulation result(s). It is a list of dictionaries.
+    source: if given, add a 'source' column with this value, e.g. the name of the data file
+    return: a dictionary of column name to numpy array
+    """
+    rows = []
+    for run in data:
+        n, k, d = run['n_k_d']
+        error_model = run.get('error_model', '')
+        axis = re.search(r"axis='(\w)'", error_model or '')
+        row = dict(run, n=n, k=k, d=d, error_model=error_model,
+                   bias=_label_value(error_model, 'bias', float('nan')),
+                   bias_axis=axis.group(1) if axis else '',
+                   chi=_label_value(run['decoder'], 'chi', -1))
+        # rates missing in old files are recomputed from the counts
+        for key, count in (('logicalx_failure_rate', 'n_xfail'), ('logicaly_failure_rate', 'n_yfail'),
+                           ('logicalz_failure_rate', 'n_zfail')):
+            if key not in row:
+                row[key] = row[count] / row['n_run'] if row['n_run'] else float('nan')
+        for key in ('logical_failure_rate', 'logicalx_failure_rate', 'logicaly_failure_rate', 'logicalz_failure_rate'):
+            row.setdefault(key + '_var', row[key] * (1 - row[key]) / row['n_run'] if row['n_run'] else 0.0)
+        rows.append(row)
+    table = {}
+    for name, dtype in SIMTABLE_COLUMNS:
+        table[name] = np.array([row[name] for row in rows], dtype=dtype if dtype is not str else None)
+        if dtype is str:
+            table[name] = table[name].astype(str)
+    if source is not None:
+        table['source'] = np.full(len(rows), source).astype(str)
+    return table
+
+def concat_tables(tables):
+    """
+    Concatenate simulation tables with the same columns.
+    tables: list of dictionaries of column name to numpy array
+    return: a dictionary of column name to numpy array
+    """
+    return {name: np.concatenate([table[name] for table in tables]) for name in tables[0]}
+
+def table_to_simdata(table):
+    """
+    Transform a simulation table back into simulation result(s), as returned by load_simdata.
+    table: a dictionary of column name to numpy array
+    return: data of simulation result(s). It is a list of dictionaries.
+    """
+    data = []
+    for i in range(len(table['n_run'])):
+        run = {
+            'code': str(table['code'][i]),
+            'n_k_d': [int(table['n'][i]), int(table['k'][i]), int(table['d'][i])],
+            'n_logical_commutations': None,
+            'custom_totals': None,
+        }
+        for name, _ in SIMTABLE_COLUMNS:
+            if name in ('code', 'n', 'k', 'd', 'bias', 'bias_axis', 'chi'):
+                continue
+            run[name] = table[name][i].item()
+        data.append(run)
+    return data
+
+def save_simtable(filename,data):
+    """
+    Save simulation result(s) as a table in a NumPy .npz file, with one typed column per field.
+    filename: the name or relative path of saved file (format:"xxx.npz").
+    data: data of simulation result(s), a list of dictionaries or a table from simdata_to_table.
+    return: none
+    """
+    table = data if isinstance(data, dict) else simdata_to_table(data)
+    with open(filename, 'wb') as f:
+        np.savez(f, **table)
+
+def load_simtable(filename):
+    """
+    Load a table of simulation result(s) saved by save_simtable.
+    filename: the name or relative path of saved file (format:"xxx.npz").
+    return: a dictionary of column name to numpy array
+    """
+    with np.load(filename, allow_pickle=False) as f:
+        return {name: f[name] for name in f.files}
+
+def convert_simdata(filename,table_filename=None):
+    """
+    Convert a file saved by save_simdata into a table file saved by save_simtable.
+    filename: the name or relative path of the data file (format:"xxx.json").
+    table_filename: the name or relative path of the table file (default: filename with .npz suffix)
+    return: the name of the table file
+    """
+    if table_filename is None:
+        table_filename = os.path.splitext(filename)[0] + '.npz'
+    save_simtable(table_filename, load_simdata(filename))
+    return table_filename
+
+def convert_all_simdata(directory='.',table_filename=None):
+    """
+    Convert all data files (*.json) under a directory into table files next to them, or into one
+    table file with a 'source' column holding the path of each data file relative to directory.
+    directory: the directory to search recursively
+    table_filename: if given, the name or relative path of the single table file
+    return: list of the names of the table files
+    """
+    filenames = sorted(glob.glob(os.path.join(directory, '**', '*.json'), recursive=True))
+    if table_filename is None:
+        return [convert_simdata(filename) for filename in filenames]
+    save_simtable(table_filename, concat_tables([
+        simdata_to_table(load_simdata(filename), source=os.path.relpath(filename, directory))
+        for filename in filenames]))
+    return [table_filename]
+
+def code_family(label):
+    """
+    Get the family of a code from its label, i.e. the label without the code size.
+    label: code label, e.g. 'Rotated planar XZ 33' or 'Rotated planar 3x3'
+    return: code family, e.g. 'Rotated planar XZ' or 'Rotated planar'
+    """
+    return re.sub(r'\s+\d+(x\d+)?$', '', label)
+
+class SimDataset:
+    """
+    Simulation results of all data files under a directory, loaded once into one table and
+    indexed by bias, code family, code distance, decoder chi and error probability.
+    directory: the directory to search recursively for data files (*.json)
+    filenames: if given, load these data files instead of searching directory
+    cache: if True, keep a table file (.npz) next to each data file, and load it instead of
+        the data file while it is newer
+    """
+    # count and rate columns of each failure channel
+    CHANNELS = {
+        'total': ('n_fail', 'logical_failure_rate'),
+        'x': ('n_xfail', 'logicalx_failure_rate'),
+        'y': ('n_yfail', 'logicaly_failure_rate'),
+        'z': ('n_zfail', 'logicalz_failure_rate'),
+    }
+
+    def __init__(self,directory='.',filenames=None,cache=True):
+        if filenames is None:
+            filenames = sorted(glob.glob(os.path.join(directory, '**', '*.json'), recursive=True))
+        tables = []
+        for filename in filenames:
+            table_filename = os.path.splitext(filename)[0] + '.npz'
+            table = None
+            if os.path.exists(table_filename) and os.path.getmtime(table_filename) >= os.path.getmtime(filename):
+                table = load_simtable(table_filename)
+                # table files of an older table format are made again
+                if any(name not in table for name, dtype in SIMTABLE_COLUMNS):
+                    table = None
+            if table is None:
+                table = simdata_to_table(load_simdata(filename))
+                if cache:
+                    save_simtable(table_filename, table)
+            table['source'] = np.full(len(table['n_run']), os.path.relpath(filename, directory)).astype(str)
+            tables.append(table)
+        self.table = concat_tables(tables) if tables else simdata_to_table([], source='')
+        self.table['family'] = np.array([code_family(label) for label in self.table['code']]).astype(str)
+        # index: (bias, family, d, chi) -> row indices sorted by error probability
+        groups = {}
+        for row, key in enumerate(zip(self.table['bias'].tolist(), self.table['family'].tolist(),
+                                      self.table['d'].tolist(), self.table['chi'].tolist())):
+            groups.setdefault(key, []).append(row)
+        self.index = {}
+        for key, rows in groups.items():
+            rows = np.array(rows)
+            rows = rows[np.argsort(self.table['error_probability'][rows], kind='stable')]
+            self.index[key] = (rows, self.table['error_probability'][rows])
+
+    def __len__(self):
+        return len(self.table['n_run'])
+
+    def query(self,bias=None,family=None,d=None,chi=None,p=None,p_min=None,p_max=None,
+              source=None,channel='total',p_tol=1e-5):
+        """
+        Select simulation points. Each argument left None selects all values.
+        bias: bias of the error model
+        family: code family, see code_family
+        d: code distance, or list of code distances
+        chi: bond dimension of the decoder
+        p: error probability, matched within p_tol
+        p_min, p_max: exclusive bounds of the error probability
+        source: data file, relative to the directory of the dataset
+        channel: failure channel of 'rate' and 'rate_err' in the result, 'total', 'x', 'y' or 'z'
+        p_tol: tolerance of matching p
+        return: a dictionary of column name to numpy array of the selected points, sorted by bias,
+            family, distance, chi and error probability, with the failure rate of the channel and its
+            standard error sqrt(rate_var), i.e. the binomial sqrt(rate*(1-rate)/n_run) of plain runs, as
+            'rate' and 'rate_err'
+        """
+        ds = None if d is None else set(np.atleast_1d(d).tolist())
+        selected = []
+        for key in sorted(self.index):
+            key_bias, key_family, key_d, key_chi = key
+            if bias is not None and not np.isclose(key_bias, bias):
+                continue
+            if (family is not None and key_family != family) or (ds is not None and key_d not in ds):
+                continue
+            if chi is not None and key_chi != chi:
+                continue
+            rows, ps = self.index[key]
+            low, high = 0, len(rows)
+            if p is not None:
+                low = max(low, np.searchsorted(ps, p - p_tol, side='left'))
+                high = min(high, np.searchsorted(ps, p + p_tol, side='right'))
+            if p_min is not None:
+                low = max(low, np.searchsorted(ps, p_min, side='right'))
+            if p_max is not None:
+                high = min(high, np.searchsorted(ps, p_max, side='left'))
+            selected.append(rows[low:high])
+        rows = np.concatenate(selected) if selected else np.array([], dtype=np.int64)
+        if source is not None:
+            rows = rows[self.table['source'][rows] == source]
+        runs = {name: column[rows] for name, column in self.table.items()}
+        count, rate = self.CHANNELS[channel]
+        runs['rate'] = runs[rate]
+        # binomial for plain runs, from the estimator for stratified runs, 0 for exact points
+        runs['rate_err'] = np.sqrt(runs[rate + '_var'])
+        return runs
+
+def iter_simdata(filename):
+    """
+    Iterate over the simulation result(s) of a file saved by save_simdata or append_simdata,
+    one line at a time. A last line which is still being written by another process is skipped.
+    filename: the name or relative path of saved file (format:"xxx.json").
+    return: iterator of dictionaries of simulation results
+    """
+    with open(filename,"r", encoding='utf-8') as f:
+        for line in f:
+            try:
+                yield json5.loads(line.rstrip(';\n'))
+            except ValueError:
+                if line.endswith('\n'):
+                    raise
+                logger.warning('skipping incomplete last line of {}'.format(filename))
+
+def simdata_key(run):
+    """
+    Identify the simulation point of a simulation result, for merging shards.
+    run: a dictionary of simulation results
+    return: a tuple of code label, n_k_d, decoder label, error model label and error probability
+    """
+    return (run['code'], tuple(run['n_k_d']), run['decoder'], run.get('error_model'), run['error_probability'])
+
+def merge_runs_data(runs_a,runs_b):
+    """
+    Merge the simulation results of two shards of the same simulation point. The variance of
+    error weights is combined exactly from the count, sum and M2 (n_run * error_weight_pvar) of each
+    shard with the parallel variance formula of Chan et al., so shards may differ in size and mean.
+    runs_a, runs_b: dictionaries of simulation results of the same point
+    return: a dictionary of the merged simulation results
+    """
+    n_a, n_b = runs_a['n_run'], runs_b['n_run']
+    n_run = n_a + n_b
+    merged = {
+        'code': runs_a['code'],
+        'n_k_d': runs_a['n_k_d'],
+        'time_steps': runs_a.get('time_steps', 1),
+        'decoder': runs_a['decoder'],
+        'error_probability': runs_a['error_probability'],
+        'measurement_error_probability': runs_a.get('measurement_error_probability', 0.0),
+        'n_run': n_run,
+        'n_success': runs_a['n_success'] + runs_b['n_success'],
+        'n_fail': runs_a['n_fail'] + runs_b['n_fail'],
+        'n_xfail' : runs_a['n_xfail'] + runs_b['n_xfail'],
+        'n_yfail' : runs_a['n_yfail'] + runs_b['n_yfail'],
+        'n_zfail' : runs_a['n_zfail'] + runs_b['n_zfail'],
+        'n_logical_commutations': None,
+        'custom_totals': None,
+        'error_weight_total': runs_a['error_weight_total'] + runs_b['error_weight_total'],
+        'error_weight_pvar': 0.0,
+        'logical_failure_rate': 0.0,
+        'physical_error_rate': 0.0,
+        'wall_time': runs_a['wall_time'] + runs_b['wall_time'],
+    }
+    # if there's 'error_model' key in data, add it into dict
+    if 'error_model' in runs_a:
+        merged['error_model'] = runs_a['error_model']
+    if n_a and n_b:
+        delta = runs_b['error_weight_total'] / n_b - runs_a['error_weight_total'] / n_a
+        m2 = (n_a * runs_a['error_weight_pvar'] + n_b * runs_b['error_weight_pvar']
+              + delta**2 * n_a * n_b / n_run)
+        merged['error_weight_pvar'] = m2 / n_run
+    else:
+        merged['error_weight_pvar'] = runs_a['error_weight_pvar'] if n_a else runs_b['error_weight_pvar']
+    # add rate statistics
+    if n_run:
+        merged['logical_failure_rate'] = merged['n_fail'] / n_run
+        merged['logicalx_failure_rate'] = merged['n_xfail'] / n_run
+        merged['logicaly_failure_rate'] = merged['n_yfail'] / n_run
+        merged['logicalz_failure_rate'] = merged['n_zfail'] / n_run
+        merged['physical_error_rate'] = (merged['error_weight_total'] / merged['n_k_d'][0]
+                                         / merged['time_steps'] / n_run)
+    # stratified shards are merged stratum by stratum (see run_stratified and run_compositions)
+    if 'stratified' in runs_a or 'stratified' in runs_b:
+        source = runs_a if 'stratified' in runs_a else runs_b
+        # strata are error weights (run_stratified) or compositions (run_compositions)
+        name = 'weights' if 'weights' in source['stratified'] else 'compositions'
+        # an empty plain record, as merge_simdata starts each point with, has no strata to add
+        empty_strata = {name: [], 'probabilities': [], 'n_run': [], 'n_fail': [], 'n_xfail': [], 'n_yfail': [], 'n_zfail': []}
+        for runs in (runs_a, runs_b):
+            if 'stratified' not in runs and (runs['n_run'] or runs.get('exact')):
+                raise ValueError('cannot merge stratified and plain results of {}'.format(source['code']))
+        strata_a = runs_a.get('stratified', empty_strata)
+        strata_b = runs_b.get('stratified', empty_strata)
+        keys_a = [tuple(np.atleast_1d(key).tolist()) for key in strata_a[name]]
+        keys_b = [tuple(np.atleast_1d(key).tolist()) for key in strata_b[name]]
+        keys = sorted(set(keys_a) | set(keys_b))
+        strata = {name: [key[0] if name == 'weights' else list(key) for key in keys]}
+        probabilities = dict(zip(keys_a, strata_a['probabilities']))
+        probabilities.update(zip(keys_b, strata_b['probabilities']))
+        strata['probabilities'] = [probabilities[key] for key in keys]
+        for count in ('n_run', 'n_fail', 'n_xfail', 'n_yfail', 'n_zfail'):
+            totals = dict.fromkeys(keys, 0)
+            for stratum_keys, stratum in ((keys_a, strata_a), (keys_b, strata_b)):
+                for key, value in zip(stratum_keys, stratum[count]):
+                    totals[key] += value
+            strata[count] = [totals[key] for key in keys]
+        strata['truncated_probability'] = max(0.0, 1 - sum(strata['probabilities']))
+        merged['stratified'] = strata
+        stratified_estimate(merged)
+        merged['error_weight_pvar'] = source['error_weight_pvar']
+        merged['physical_error_rate'] = source['physical_error_rate']
+        if 'reweighted' in source:
+            merged['reweighted'] = source['reweighted']
+    # seed metadata of the shards is kept, so that a shard is never run again with the same seed
+    seeds = [seed for runs in (runs_a, runs_b)
+             for seed in runs.get('seeds', [runs['seed']] if 'seed' in runs else [])]
+    if seeds:
+        merged['seeds'] = seeds
+    # exact failure rates of the point (see exact_runs_data) are kept, and stand in for rates without runs
+    exact = runs_a.get('exact') or runs_b.get('exact')
+    if exact:
+        merged['exact'] = exact
+        if not n_run:
+            merged.update(exact)
+            merged['physical_error_rate'] = merged['error_probability']
+    return merged
+
+def merge_simdata(filenames):
+    """
+    Merge shards of simulation results into one result per simulation point, streaming over the
+    shard files. Shards may come in any order and hold different sets of points; memory grows
+    with the number of points only.
+    filenames: list of names or relative paths of shard files, or a glob pattern of them
+    return: data of merged simulation result(s), in order of first appearance. It is a list of dictionaries.
+    """
+    if isinstance(filenames, str):
+        filenames = sorted(glob.glob(filenames))
+    merged = {}
+    for filename in filenames:
+        for run in iter_simdata(filename):
+            key = simdata_key(run)
+            merged[key] = merge_runs_data(merged[key], run) if key in merged else merge_runs_data(run, {
+                'n_run': 0, 'n_success': 0, 'n_fail': 0, 'n_xfail': 0, 'n_yfail': 0, 'n_zfail': 0,
+                'error_weight_total': 0, 'error_weight_pvar': 0.0, 'wall_time': 0.0})
+    return list(merged.values())
+
+# lower and upper bounds of (pc, nu, A, B, C) in fits of scaling_ansatz
+SCALING_BOUNDS = ([0, 1e-3, -np.inf, -np.inf, -np.inf], [1, np.inf, np.inf, np.inf, np.inf])
+
+def scaling_ansatz(p_d,pc,nu,A,B,C):
+    """
+    Finite-size scaling ansatz of failure rates near threshold, A + B*x + C*x^2 with rescaled
+    error probability x = (p-pc)*d^(1/nu).
+    p_d: data form as (p,d), function input.
+    pc,nu,A,B,C: function coefficient.
+    return: fitting value of function output.
+    """
+    x = (p_d[0]-pc)*p_d[1]**(1/nu)
+    return A + B*x + C*x**2
+
+def scaling_jacobian(p_d,pc,nu,A,B,C):
+    """
+    Jacobian of scaling_ansatz with respect to pc, nu, A, B and C.
+    p_d: data form as (p,d)
+    pc,nu,A,B,C: function coefficient.
+    return: a (len(p), 5) array of partial derivatives
+    """
+    p, d = p_d
+    scale = d**(1/nu)
+    x = (p-pc)*scale
+    slope = B + 2*C*x
+    return np.column_stack((-slope*scale, -slope*x*np.log(d)/nu**2, np.ones_like(x), x, x**2))
+
+def scaling_sigma(n_fail,n_run):
+    """
+    Binomial standard errors of failure rates used as fitting weights. The rate is shifted by
+    half a count, so points without failures are not given infinite weight.
+    n_fail: array of numbers of failures
+    n_run: array of numbers of runs
+    return: an array of standard errors
+    """
+    rate = (np.asarray(n_fail) + 0.5) / (np.asarray(n_run) + 1)
+    return np.sqrt(rate*(1-rate)/np.asarray(n_run))
+
+def scaling_data(window):
+    """
+    Failure rates of the points of a window and their standard errors used as fitting weights.
+    Plain Monte Carlo points are fitted on n_fail/n_run with scaling_sigma. Points whose 'rate'
+    differs from n_fail/n_run, e.g. estimates of run_stratified or reweight_compositions, are
+    fitted on 'rate' with 'rate_err', as n_fail/n_run is then not their failure rate.
+    window: a dictionary with 'p', 'd', 'n_fail' and 'n_run' arrays, and optionally 'rate' and
+        'rate_err' arrays, e.g. from SimDataset.query
+    return: arrays of failure rates and of their standard errors
+    """
+    n_fail = np.asarray(window['n_fail'])
+    n_run = np.asarray(window['n_run'])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = n_fail / n_run
+        sigma = scaling_sigma(n_fail, n_run)
+    if 'rate' in window:
+        estimated = ~np.isclose(window['rate'], rate, rtol=1e-9, atol=0)
+        rate = np.where(estimated, window['rate'], rate)
+        sigma = np.where(estimated, window['rate_err'], sigma)
+    return rate, sigma
+
+def fit_scaling(p,d,n_fail,n_run,p0=None,maxfev=50000,rate=None,sigma=None,weighted=True):
+    """
+    Weighted least squares fit of scaling_ansatz to failure rates, with analytic Jacobian.
+    p: array of physical error rates
+    d: array of code distances
+    n_fail: array of numbers of failures
+    n_run: array of numbers of runs
+    p0: starting (pc, nu, A, B, C), e.g. the fit of a neighbouring window (default: pc at the
+        middle of p, nu = 1 and A, B, C solved linearly for them)
+    maxfev: maximal number of function evaluations
+    rate, sigma: if given, the failure rates and their standard errors fitted instead of
+        n_fail/n_run and scaling_sigma (see scaling_data)
+    weighted: if False, fit without weights, with the covariance scaled by the residuals
+    return: the fitted (pc, nu, A, B, C) and their covariance, as op.curve_fit
+    """
+    p_d = np.vstack((np.asarray(p, dtype=float), np.asarray(d, dtype=float)))
+    if rate is None:
+        rate, sigma = scaling_data({'n_fail': n_fail, 'n_run': n_run})
+    rate, sigma = np.asarray(rate, dtype=float), np.asarray(sigma, dtype=float)
+    if not weighted:
+        sigma = np.ones_like(rate)
+    if p0 is None:
+        # the ansatz is linear in A, B and C once pc and nu are fixed
+        pc, nu = float(np.median(p_d[0])), 1.0
+        x = (p_d[0]-pc)*p_d[1]**(1/nu)
+        design = np.column_stack((np.ones_like(x), x, x**2)) / sigma[:, None]
+        coefficients = np.linalg.lstsq(design, rate/sigma, rcond=None)[0]
+        p0 = [pc, nu, *coefficients]
+    # pc is a probability and nu is positive
+    p0 = np.clip(p0, SCALING_BOUNDS[0], SCALING_BOUNDS[1])
+    return op.curve_fit(scaling_ansatz, p_d, rate, p0=p0, sigma=sigma, absolute_sigma=weighted,
+                        jac=scaling_jacobian, bounds=SCALING_BOUNDS, maxfev=maxfev)
+
+def _scaling_chisq(window,popt,weighted=True):
+    """
+    Weighted (or plain) sum of squared residuals of a fit of scaling_ansatz to a window.
+    """
+    p_d = np.vstack((np.asarray(window['p'], dtype=float), np.asarray(window['d'], dtype=float)))
+    rate, sigma = scaling_data(window)
+    if not weighted:
+        sigma = 1.0
+    return float(np.sum(((scaling_ansatz(p_d, *popt) - rate) / sigma)**2))
+
+def _at_scaling_bounds(popt,rel_tol=1e-6):
+    """
+    Whether the pc of a fit ended on its bounds, i.e. the fit degenerated.
+    """
+    lower, upper = SCALING_BOUNDS[0][0], SCALING_BOUNDS[1][0]
+    return popt[0] - lower <= rel_tol or upper - popt[0] <= rel_tol
+
+def _fit_scaling_series(windows,p0=None):
+    """
+    Fit a series of windows of one channel, each starting from the fit of the previous one. The
+    default starting point of fit_scaling is tried as well, and the better fit is kept, so a poor
+    fit of one window does not carry over to the next. Where the quadratic ansatz cannot describe
+    a window within its error bars, e.g. a window reaching far below threshold, the weighted fit
+    degenerates to pc on its bounds; such a window is fitted without weights instead, with a warning.
+    windows: list of dictionaries with 'p', 'd', 'n_fail' and 'n_run' arrays, and optionally
+        'rate' and 'rate_err' arrays (see scaling_data)
+    p0: starting point of the first window
+    return: list of (popt, pcov, weighted) of each window, nan if a fit fails
+    """
+    fits = []
+    for window in windows:
+        best = None
+        rate, sigma = scaling_data(window)
+        for weighted in (True, False):
+            for start in ([p0, None] if p0 is not None else [None]):
+                try:
+                    popt, pcov = fit_scaling(window['p'], window['d'], window['n_fail'], window['n_run'], start,
+                                             rate=rate, sigma=sigma, weighted=weighted)
+                except (RuntimeError, ValueError, np.linalg.LinAlgError):
+                    continue
+                if (best is None or _scaling_chisq(window, popt, weighted)
+                        < _scaling_chisq(window, best[0], weighted)):
+                    best = (popt, pcov, weighted)
+            if best is not None and not _at_scaling_bounds(best[0]):
+                break
+            if weighted:
+                logger.warning('weighted scaling fit of the window d={} degenerates, fitting it without weights'.format(
+                    sorted(set(np.asarray(window['d']).tolist()))))
+                best = None
+        if best is None:
+            best = (np.full(5, np.nan), np.full((5, 5), np.nan), True)
+        else:
+            p0 = best[0]
+        fits.append(best)
+    return fits
+
+def refit_scaling(p,d,rates,sigmas,popt,max_iter=100,tol=1e-10):
+    """
+    Refit scaling_ansatz to many datasets of the same points at once, e.g. bootstrap replicas,
+    by Levenberg-Marquardt iterations on all datasets together. Each dataset starts from popt,
+    the fit of the original data, so a few iterations are enough.
+    p: array of physical error rates
+    d: array of code distances
+    rates: (n_datasets, len(p)) array of failure rates
+    sigmas: (n_datasets, len(p)) array of their standard errors used as fitting weights
+    popt: starting (pc, nu, A, B, C)
+    max_iter: maximal number of iterations
+    tol: relative change of the weighted sum of squared residuals at which a fit is converged
+    return: a (n_datasets, 5) array of fitted (pc, nu, A, B, C), nan if a fit does not converge
+        or its normal equations become singular
+    """
+    p = np.asarray(p, dtype=float)
+    log_d = np.log(np.asarray(d, dtype=float))
+    rates = np.asarray(rates, dtype=float)
+    sigmas = np.asarray(sigmas, dtype=float)
+    lower, upper = np.array(SCALING_BOUNDS[0]), np.array(SCALING_BOUNDS[1])
+
+    def residuals_and_jacobian(params):
+        pc, nu, A, B, C = (params[:, i:i+1] for i in range(5))
+        scale = np.exp(log_d / nu)
+        x = (p - pc)*scale
+        slope = B + 2*C*x
+        residuals = (A + B*x + C*x**2 - rates) / sigmas
+        jacobian = np.stack((-slope*scale, -slope*x*log_d/nu**2, np.ones_like(x), x, x**2), axis=2)
+        return residuals, jacobian / sigmas[:, :, None]
+
+    params = np.tile(np.asarray(popt, dtype=float), (len(rates), 1))
+    damping = np.full(len(rates), 1e-3)
+    residuals, jacobian = residuals_and_jacobian(params)
+    chisq = np.sum(residuals**2, axis=1)
+    converged = np.zeros(len(rates), dtype=bool)
+    failed = ~np.isfinite(chisq)
+    converged |= failed
+    for _ in range(max_iter):
+        normal = np.matmul(jacobian.transpose(0, 2, 1), jacobian)
+        gradient = np.matmul(jacobian.transpose(0, 2, 1), residuals[:, :, None])[:, :, 0]
+        diagonal = np.diagonal(normal, axis1=1, axis2=2)
+        damped = normal + (damping[:, None]*diagonal)[:, :, None]*np.eye(5)
+        try:
+            step = np.linalg.solve(damped, -gradient[:, :, None])[:, :, 0]
+        except np.linalg.LinAlgError:
+            # solve the datasets one by one, and give up those whose equations are singular
+            step = np.zeros_like(params)
+            for i in np.flatnonzero(~converged):
+                try:
+                    step[i] = np.linalg.solve(damped[i], -gradient[i])
+                except np.linalg.LinAlgError:
+                    failed[i] = converged[i] = True
+        trial = np.clip(params + step, lower, upper)
+        trial_residuals, trial_jacobian = residuals_and_jacobian(trial)
+        trial_chisq = np.sum(trial_residuals**2, axis=1)
+        # accept the steps which decrease the residuals, and damp the others more
+        accepted = (trial_chisq <= chisq) & ~converged
+        converged |= accepted & (chisq - trial_chisq <= tol*chisq)
+        params[accepted] = trial[accepted]
+        residuals[accepted] = trial_residuals[accepted]
+        jacobian[accepted] = trial_jacobian[accepted]
+        chisq[accepted] = trial_chisq[accepted]
+        damping = np.where(accepted, damping/10, damping*10)
+        converged |= damping > 1e10
+        if converged.all():
+            break
+    params[failed | ~np.isfinite(chisq)] = np.nan
+    return params
+
+def bootstrap_counts(n_fail,n_run,n_boot,rng):
+    """
+    Parametric bootstrap replicas of failure counts: the failures of every point are drawn
+    again from the binomial distribution of its observed failure rate.
+    n_fail: array of numbers of failures
+    n_run: array of numbers of runs
+    n_boot: number of replicas
+    rng: numpy random generator
+    return: a (n_boot, len(n_fail)) array of numbers of failures
+    """
+    n_run = np.asarray(n_run)
+    return rng.binomial(n_run, np.asarray(n_fail) / n_run, size=(n_boot, len(n_run)))
+
+def bootstrap_rates(window,n_boot,rng):
+    """
+    Parametric bootstrap replicas of the failure rates of a window. The failures of plain Monte
+    Carlo points are drawn again with bootstrap_counts, and each replica is weighted with its own
+    scaling_sigma. Estimated points (see scaling_data) are drawn from the normal distribution of
+    their rate and standard error.
+    window: a dictionary with 'p', 'd', 'n_fail' and 'n_run' arrays, and optionally 'rate' and 'rate_err'
+    n_boot: number of replicas
+    rng: numpy random generator
+    return: (n_boot, n_points) arrays of failure rates and of their standard errors
+    """
+    n_run = np.asarray(window['n_run'])
+    rate, sigma = scaling_data(window)
+    estimated = rate != np.asarray(window['n_fail']) / np.maximum(n_run, 1)
+    n_fails = bootstrap_counts(window['n_fail'], np.maximum(n_run, 1), n_boot, rng)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rates = n_fails / n_run
+        sigmas = scaling_sigma(n_fails, n_run)
+    if estimated.any():
+        rates[:, estimated] = rate[estimated] + sigma[estimated]*rng.standard_normal((n_boot, estimated.sum()))
+        sigmas[:, estimated] = sigma[estimated]
+    return rates, sigmas
+
+def bootstrap_interval(replicas,level=0.95):
+    """
+    Percentile interval of bootstrap replicas, ignoring failed fits.
+    replicas: (n_boot, n_params) array of refitted parameters
+    level: confidence level of the interval
+    return: arrays of lower and upper bounds of each parameter
+    """
+    return (np.nanpercentile(replicas, 50*(1-level), axis=0),
+            np.nanpercentile(replicas, 50*(1+level), axis=0))
+
+def _bootstrap_datasets(windows,channels,n_boot,entropy,cache=None):
+    """
+    Bootstrap replicas of the failure rates of every channel and window (see bootstrap_rates), drawn
+    from chunk_rng(entropy, i, 0) for the i-th (channel, window) pair. With a cache file, the replicas
+    are saved there and loaded again while the data, n_boot and entropy are the same.
+    return: a dictionary of (channel, window index) to (n_boot, n_points) arrays of rates and of
+        their standard errors
+    """
+    names = {(channel, window_index): '{}_{}'.format(channel, window_index)
+             for channel in channels for window_index in range(len(windows))}
+    fingerprint = json.dumps(['rates', n_boot, str(entropy)] + [
+        [np.asarray(window[channel][name]).tolist() for name in ('p', 'd', 'n_fail', 'n_run', 'rate', 'rate_err')
+         if name in window[channel]]
+        for channel in channels for window in windows])
+    if cache and os.path.exists(cache):
+        with np.load(cache, allow_pickle=False) as saved:
+            if str(saved['fingerprint']) == fingerprint:
+                return {key: (saved['rates_' + name], saved['sigmas_' + name]) for key, name in names.items()}
+    datasets = {}
+    for channel_index, channel in enumerate(channels):
+        for window_index, window in enumerate(windows):
+            datasets[channel, window_index] = bootstrap_rates(
+                window[channel], n_boot, chunk_rng(entropy, channel_index*len(windows) + window_index, 0))
+    if cache:
+        arrays = {}
+        for key, (rates, sigmas) in datasets.items():
+            arrays['rates_' + names[key]] = rates
+            arrays['sigmas_' + names[key]] = sigmas
+        np.savez(cache, fingerprint=np.array(fingerprint), **arrays)
+    return datasets
+
+def fit_threshold_trend(windows,n_boot=0,processes=None,seed=None,chunk_size=100,cache=None,level=0.95):
+    """
+    Fit scaling_ansatz to every failure channel of a series of distance windows. The channels are
+    fitted in parallel, each window starting from the fit of the previous one. Parametric bootstrap
+    replicas (see bootstrap_rates) of all channels and windows are then refitted in chunks in the
+    same pool, each starting from the fit of the data (see refit_scaling).
+    windows: list of dictionaries of channel to a dictionary with 'p', 'd', 'n_fail' and 'n_run'
+        arrays of the points of the window, and optionally their 'rate' and 'rate_err' (see
+        scaling_data), e.g. from SimDataset.query
+    n_boot: number of bootstrap replicas of each channel and window (0 for none)
+    processes: number of worker processes (default: number of cpu cores)
+    seed: root seed of the bootstrap (default: fresh entropy); the replicas of the i-th
+        (channel, window) pair are drawn from chunk_rng(entropy, i, 0)
+    chunk_size: number of replicas refitted per task
+    cache: if given, a file (.npz) keeping the bootstrap replicas of the rates between runs
+    level: confidence level of the percentile intervals
+    return: a dictionary of channel to a list of dictionaries with 'popt' and 'pcov' of each window,
+        'weighted', False if the window was fitted without weights (see _fit_scaling_series), and, if n_boot is given, with 'bootstrap', the (n_boot, 5) array of refitted replicas, and
+        'interval', the percentile interval of each parameter (see bootstrap_interval)
+    """
+    channels = list(windows[0])
+    entropy = seed_entropy(seed)
+    with multiprocessing.Pool(processes=processes) as pool:
+        series = pool.starmap(_fit_scaling_series, [([window[channel] for window in windows],) for channel in channels])
+        results = {channel: [{'popt': popt, 'pcov': pcov, 'weighted': weighted} for popt, pcov, weighted in fits]
+                   for channel, fits in zip(channels, series)}
+        if n_boot:
+            datasets = _bootstrap_datasets(windows, channels, n_boot, entropy, cache)
+            tasks = []
+            for (channel, window_index), (rates, sigmas) in datasets.items():
+                window = windows[window_index][channel]
+                popt = results[channel][window_index]['popt']
+                # windows whose fit failed have no replicas to refit
+                if not np.all(np.isfinite(popt)):
+                    continue
+                # replicas are refitted as the data, with or without weights
+                if not results[channel][window_index]['weighted']:
+                    sigmas = np.ones_like(sigmas)
+                for start in range(0, n_boot, chunk_size):
+                    tasks.append((channel, window_index, pool.apply_async(refit_scaling, (
+                        window['p'], window['d'], rates[start:start+chunk_size], sigmas[start:start+chunk_size], popt))))
+            replicas = {}
+            for channel, window_index, task in tasks:
+                replicas.setdefault((channel, window_index), []).append(task.get())
+            for channel in channels:
+                for window_index, result in enumerate(results[channel]):
+                    chunks = replicas.get((channel, window_index), [np.full((n_boot, 5), np.nan)])
+                    result['bootstrap'] = np.vstack(chunks)
+                    with warnings.catch_warnings():
+                        # all-nan replicas of a failed fit give nan intervals
+                        warnings.simplefilter('ignore', RuntimeWarning)
+                        result['interval'] = bootstrap_interval(result['bootstrap'], level)
+    return results
+
+# suffixes of the per-channel copies of a window data file, as in threshold_trend
+CHANNEL_SUFFIXES = {'total': '_total', 'x': '_logicalx', 'y': '_logicaly', 'z': '_logicalz'}
+
+def channel_mask(table,selection,p_tol=1e-9):
+    """
+    Select the points of a channel from a table of a window (see migrate_channel_files).
+    table: a dictionary of column name to numpy array, e.g. SimDataset.table
+    selection: a dictionary with 'p_min', 'p_max' and 'd' of the channel
+    p_tol: tolerance of matching p_min and p_max
+    return: a boolean array of the selected rows
+    """
+    p = table['error_probability']
+    return ((p >= selection['p_min'] - p_tol) & (p <= selection['p_max'] + p_tol)
+            & np.isin(table['d'], selection['d']))
+
+def channel_table(table,selection,directory='.',p_tol=1e-9):
+    """
+    Select the rows of a table of a window which a channel is fitted on (see channel_mask). If the
+    selection names a conflicts file (see migrate_channel_files), its results of the channel take
+    the place of those of the window at the same points.
+    table: a dictionary of column name to numpy array, e.g. SimDataset.table
+    selection: a dictionary with 'p_min', 'p_max' and 'd' of the channel, and optionally 'conflicts'
+    directory: the directory of the conflicts file
+    p_tol: tolerance of matching error probabilities
+    return: a dictionary of column name to numpy array of the selected rows
+    """
+    selected = channel_mask(table, selection, p_tol)
+    rows = {name: column[selected] for name, column in table.items()}
+    if 'conflicts' in selection:
+        conflicts = simdata_to_table(load_simdata(os.path.join(directory, selection['conflicts'])))
+        for i in range(len(conflicts['n_run'])):
+            match = ((np.abs(rows['error_probability'] - conflicts['error_probability'][i]) <= p_tol)
+                     & (rows['d'] == conflicts['d'][i]))
+            for name, dtype in SIMTABLE_COLUMNS:
+                if dtype is not str:
+                    rows[name][match] = conflicts[name][i]
+    return rows
+
+def migrate_channel_files(directory='.',index_filename='windows.json5',remove=False,table_filename=None,
+                          save_conflicts=True):
+    """
+    Collapse each group of a window data file 'name.json' and its per-channel copies
+    'name_total.json', 'name_logicalx.json', 'name_logicaly.json' and 'name_logicalz.json'
+    into the window file alone. Every result already holds the counts of all channels, so a
+    copy only records which points the channel is fitted on: its range of p and its code
+    distances, which are saved to the index file as
+    {window file: {channel: {'p_min': ..., 'p_max': ..., 'd': [...]}}} (see channel_mask).
+    Results found in copies only are added to the window file. Of two different results of the
+    same point, the one in the window file (or the first copy) is kept as it is, and the others
+    are reported, together with copies which are not a range of p of the window. Whether they
+    are independent samples to merge (see merge_runs_data) or reruns to drop is left to the user.
+    The other results of a copy, e.g. 'name_logicalx.json', are saved to 'name_logicalx.conflicts'
+    in the format of the data files (see load_simdata), which the index names as the 'conflicts'
+    of the channel, so that the channel is still fitted on them (see channel_table).
+    directory: the directory of the data files
+    index_filename: the name of the index file in directory, updated if it exists. It is not
+        named *.json, so it is not taken for a data file.
+    remove: if True, remove the copies once the window file and the index are written
+    table_filename: if given, also save all window files into this table file, see convert_all_simdata
+    save_conflicts: if True, save the other results of conflicting points to the conflicts files
+    return: a dictionary with the number of 'windows', 'duplicates' (identical results dropped),
+        'conflicts' and 'not_ranges' (lists of descriptions), 'added' (results moved to window
+        files), and 'bytes_before' and 'bytes_after' of the data files
+    """
+    report = {'windows': 0, 'duplicates': 0, 'added': 0, 'conflicts': [], 'not_ranges': [],
+              'bytes_before': 0, 'bytes_after': 0}
+    index_path = os.path.join(directory, index_filename)
+    index = {}
+    if os.path.exists(index_path):
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index = json5.load(f)
+    count_fields = ('n_run', 'n_success', 'n_fail', 'n_xfail', 'n_yfail', 'n_zfail', 'error_weight_total')
+    filenames = sorted(glob.glob(os.path.join(directory, '*.json')))
+    for filename in filenames:
+        report['bytes_before'] += os.path.getsize(filename)
+    suffixes = tuple(suffix + '.json' for suffix in CHANNEL_SUFFIXES.values())
+    windows = [filename for filename in filenames if not filename.endswith(suffixes)
+               and all(os.path.exists(filename[:-len('.json')] + suffix) for suffix in suffixes)]
+    for window in windows:
+        name = os.path.relpath(window, directory)
+        logger.info('migrating {}'.format(name))
+        records = list(iter_simdata(window))
+        keys = {simdata_key(run): i for i, run in enumerate(records)}
+        # counts of the results of each point seen so far, so that a result in several copies is reported once
+        seen = {key: {tuple(records[i].get(field) for field in count_fields)} for key, i in keys.items()}
+        changed = False
+        selections = {}
+        for channel, suffix in CHANNEL_SUFFIXES.items():
+            copy = window[:-len('.json')] + suffix + '.json'
+            copy_keys = set()
+            conflicts = []
+            for run in iter_simdata(copy):
+                key = simdata_key(run)
+                copy_keys.add(key)
+                counts = tuple(run.get(field) for field in count_fields)
+                if key not in keys:
+                    keys[key] = len(records)
+                    records.append(run)
+                    seen[key] = {counts}
+                    report['added'] += 1
+                    changed = True
+                    continue
+                if counts in seen[key]:
+                    report['duplicates'] += 1
+                    continue
+                seen[key].add(counts)
+                conflicts.append(run)
+                report['conflicts'].append('{}: {} p={} d={} has n_run={} in {} and n_run={} in {}, kept the former'.format(
+                    name, channel, run['error_probability'], run['n_k_d'][2], records[keys[key]]['n_run'], name,
+                    run['n_run'], os.path.relpath(copy, directory)))
+            ps = [key[4] for key in copy_keys]
+            selection = {'p_min': min(ps), 'p_max': max(ps), 'd': sorted({key[1][2] for key in copy_keys})}
+            table = {'error_probability': np.array([run['error_probability'] for run in records]),
+                     'd': np.array([run['n_k_d'][2] for run in records])}
+            selected = {simdata_key(records[i]) for i in np.flatnonzero(channel_mask(table, selection))}
+            if selected != copy_keys:
+                report['not_ranges'].append('{}: {} selects {} points of the window in its range, {} has {}'.format(
+                    name, channel, len(selected), os.path.relpath(copy, directory), len(copy_keys)))
+            if conflicts and save_conflicts:
+                save_simdata(copy[:-len('.json')] + '.conflicts', conflicts)
+                selection['conflicts'] = os.path.basename(copy[:-len('.json')] + '.conflicts')
+            selections[channel] = selection
+        if changed:
+            save_simdata(window, records)
+        index[name] = selections
+        report['windows'] += 1
+    # one line per window
+    _write_atomic(index_path, '{\n' + ',\n'.join('{}: {}'.format(json.dumps(name), json.dumps(index[name], sort_keys=True))
+                                                 for name in sorted(index)) + '\n}\n')
+    if remove:
+        for window in windows:
+            for suffix in CHANNEL_SUFFIXES.values():
+                os.remove(window[:-len('.json')] + suffix + '.json')
+    for filename in glob.glob(os.path.join(directory, '*.json')):
+        report['bytes_after'] += os.path.getsize(filename)
+    if table_filename:
+        save_simtable(table_filename, concat_tables([
+            simdata_to_table(load_simdata(window), source=os.path.relpath(window, directory)) for window in windows]))
+    return report
+
+def reshape_data(data_name,data_num):
+    """
+    Compose a series of data files into one data file. Each data file name should be like: data_name + data_num + '.json'.
+    data_name: the name of data file.
+    data_num: number of the data file series.
+    return: one data file which contains all simulation information of the data series.
+    """
+    return merge_simdata([data_name+'{}'.format(i)+'.json' for i in range(data_num)])
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Run or gather the work units of a sweep queue, migrate data files, or follow a status file.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    worker_parser = subparsers.add_parser('worker', help='run work units of a queue')
+    worker_parser.add_argument('queue_dir')
+    worker_parser.add_argument('--processes', type=int, default=None)
+    worker_parser.add_argument('--lease-time', type=float, default=600)
+    gather_parser = subparsers.add_parser('gather', help='merge the results of a queue')
+    gather_parser.add_argument('queue_dir')
+    gather_parser.add_argument('filename')
+    migrate_parser = subparsers.add_parser('migrate', help='collapse per-channel copies of window data files')
+    migrate_parser.add_argument('directory')
+    migrate_parser.add_argument('--remove', action='store_true', help='remove the copies')
+    migrate_parser.add_argument('--table', default=None, help='also save the windows into this table file')
+    migrate_parser.add_argument('--no-conflicts-file', action='store_true',
+                                help='only report different results of the same point, without saving them to conflicts files')
+    status_parser = subparsers.add_parser('status', help='print the status file of a running simulation')
+    status_parser.add_argument('filename')
+    status_parser.add_argument('--follow', action='store_true', help='keep printing until the simulation finishes')
+    status_parser.add_argument('--interval', type=float, default=5, help='seconds between checks for updates')
+    args = parser.parse_args()
+    if args.command == 'worker':
+        run_queue_local(args.queue_dir, args.processes, args.lease_time)
+    elif args.command == 'gather':
+        gather_queue(args.queue_dir, args.filename)
+    elif args.command == 'migrate':
+        report = migrate_channel_files(args.directory, remove=args.remove, table_filename=args.table,
+                                       save_conflicts=not args.no_conflicts_file)
+        for line in report['conflicts'] + report['not_ranges']:
+            print(line)
+        print('{} windows, {} duplicates dropped, {} results added, {} conflicts, {} bytes -> {} bytes'.format(
+            report['windows'], report['duplicates'], report['added'], len(report['conflicts']),
+            report['bytes_before'], report['bytes_after']))
+    elif args.command == 'status':
+        watch_status(args.filename, args.follow, args.interval)